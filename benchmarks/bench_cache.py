@@ -0,0 +1,106 @@
+import asyncio
+import time
+from datetime import date
+
+import pytest
+
+from cache import ResponseCache
+from client import EarthSignatureClient
+from server import ServerConfig, serve_in_thread
+from utils import request_earthsignature
+
+AOI = "POLYGON ((0 40, 20 40, 20 55, 0 55, 0 40))"
+LATENCY = 0.5
+
+
+@pytest.fixture(scope="module")
+def slow_server_port():
+    config = ServerConfig.from_environ(
+        {
+            "SNAPEARTH_SERVER_PORT": "0",
+            "SNAPEARTH_SERVER_SIZE": "64",
+            "SNAPEARTH_SERVER_LATENCY": str(LATENCY),
+        },
+    )
+    with serve_in_thread(config) as port:
+        yield port
+
+
+def query(cache, port, n_results=5, month=3):
+    # Each query runs in its own event loop, as `plot_responses` does
+    return asyncio.run(
+        request_earthsignature(
+            "127.0.0.1",
+            port,
+            False,
+            AOI,
+            date(2021, month, 1),
+            date(2021, month + 1, 1),
+            [],
+            [],
+            n_results,
+            cache=cache,
+            client=EarthSignatureClient("127.0.0.1", port, False),
+        ),
+    )
+
+
+def created(cache):
+    return sorted(created for (created,) in cache._index.execute("SELECT created FROM entries"))
+
+
+def bench_cache_fresh_hit(benchmark, slow_server_port, tmp_path):
+    benchmark.group = "cache"
+    cache = ResponseCache(tmp_path, 2**30, ttl=3600)
+    expected = query(cache, slow_server_port)
+    responses = benchmark(query, cache, slow_server_port)
+    assert [r.product_id for r in responses] == [r.product_id for r in expected]
+    cache.close()
+
+
+def bench_cache_stale_hit(benchmark, slow_server_port, tmp_path):
+    benchmark.group = "cache"
+    cache = ResponseCache(tmp_path, 2**30, ttl=0, stale_ttl=3600)
+    query(cache, slow_server_port)
+    before = created(cache)
+    start = time.perf_counter()
+    responses = query(cache, slow_server_port)
+    # Stale entries are served from disk without waiting for their refresh
+    assert time.perf_counter() - start < LATENCY / 2
+    assert len(responses) == 5
+    cache.wait_refreshed()
+    assert created(cache)[0] > before[0]
+    benchmark(query, cache, slow_server_port)
+    cache.close()
+
+
+def bench_cache_expired_miss(benchmark, slow_server_port, tmp_path):
+    benchmark.group = "cache"
+    cache = ResponseCache(tmp_path, 2**30, ttl=0)
+    query(cache, slow_server_port)
+    start = time.perf_counter()
+    benchmark(query, cache, slow_server_port)
+    # Expired entries are fetched again
+    assert time.perf_counter() - start >= LATENCY
+    cache.close()
+
+
+def bench_cache_eviction(benchmark, slow_server_port, tmp_path):
+    benchmark.group = "cache"
+    cache = ResponseCache(tmp_path, 2**30, ttl=3600)
+    for month in range(1, 7):
+        query(cache, slow_server_port, month=month)
+    total = sum(path.stat().st_size for path in tmp_path.rglob("*") if path.suffix != ".sqlite")
+    cache.max_bytes = total // 2
+    benchmark(cache.evict)
+    blobs = {
+        "/".join(path.relative_to(cache.blobs.directory).parts)
+        for path in cache.blobs.directory.rglob("*")
+        if path.is_file()
+    }
+    referenced = {ref for (ref,) in cache._index.execute("SELECT DISTINCT ref FROM blobs")}
+    sizes = sum(size for (size,) in cache._index.execute("SELECT size FROM entries"))
+    # Evicted entries release their blobs and the rest fits in the budget
+    assert blobs == referenced
+    assert 0 < sizes + sum(cache.blobs.size(ref) for ref in blobs) <= cache.max_bytes
+    cache.close()
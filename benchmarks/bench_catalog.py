@@ -0,0 +1,41 @@
+from datetime import date
+
+import pytest
+
+from catalog import Catalog
+from client import get_client
+from utils import build_request
+
+AOI = "POLYGON ((0 40, 20 40, 20 55, 0 55, 0 40))"
+
+
+@pytest.fixture
+def request_():
+    return build_request(AOI, date(2021, 3, 1), date(2021, 6, 1), [], [], 20)
+
+
+async def collect(responses):
+    return [response async for response in responses]
+
+
+def bench_query_network(benchmark, loop, server_port, request_):
+    benchmark.group = "catalog"
+    client = get_client("127.0.0.1", server_port, False)
+    benchmark(lambda: loop.run_until_complete(collect(client.stream_segmentation(request_))))
+
+
+def bench_query_catalog(benchmark, loop, server_port, request_, tmp_path):
+    benchmark.group = "catalog"
+    client = get_client("127.0.0.1", server_port, False)
+    catalog = Catalog(tmp_path)
+    fetched = []
+
+    def fetch(request):
+        fetched.append(request)
+        return client.stream_segmentation(request)
+
+    # Fill the catalog, the following queries are answered locally
+    loop.run_until_complete(collect(catalog.stream(request_, fetch)))
+    responses = benchmark(lambda: loop.run_until_complete(collect(catalog.stream(request_, fetch))))
+    assert len(responses) == request_.n_results and len(fetched) == 1
+    catalog.close()
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from grpclib.client import Channel
+
+from client import EarthSignatureClient
+from server import ServerConfig, serve_in_thread
+from snapearth.api.v1.database_grpc import DatabaseProductServiceStub
+from snapearth.api.v1.database_pb2 import ListSegmentationRequest
+
+N_RESULTS = 5
+
+
+@pytest.fixture(scope="module")
+def server_port():
+    # Small rasters, these benchmarks measure the connection overhead
+    cfg = ServerConfig.from_environ({"SNAPEARTH_SERVER_PORT": "0", "SNAPEARTH_SERVER_SIZE": "64"})
+    with serve_in_thread(cfg) as port:
+        yield port
+
+
+def bench_channel_per_request(benchmark, server_port, loop):
+    request = ListSegmentationRequest(n_results=N_RESULTS)
+
+    async def query():
+        async with Channel("127.0.0.1", server_port) as channel:
+            return await DatabaseProductServiceStub(channel).ListSegmentation(request)
+
+    responses = benchmark(lambda: loop.run_until_complete(query()))
+    assert len(responses) == N_RESULTS
+
+
+def bench_pooled_client(benchmark, server_port, loop):
+    request = ListSegmentationRequest(n_results=N_RESULTS)
+    client = EarthSignatureClient("127.0.0.1", server_port, use_ssl=False)
+    responses = benchmark(lambda: loop.run_until_complete(client.list_segmentation(request)))
+    client.close()
+    assert len(responses) == N_RESULTS
+
+
+@pytest.mark.parametrize("pool_size", [1, 4])
+def bench_pooled_client_concurrent(benchmark, server_port, loop, pool_size):
+    request = ListSegmentationRequest(n_results=N_RESULTS)
+    client = EarthSignatureClient("127.0.0.1", server_port, use_ssl=False, pool_size=pool_size)
+
+    async def query():
+        return await asyncio.gather(*(client.list_segmentation(request) for _ in range(16)))
+
+    results = benchmark(lambda: loop.run_until_complete(query()))
+    client.close()
+    assert all(len(responses) == N_RESULTS for responses in results)
@@ -0,0 +1,44 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from utils import CATEGORY_TO_RGB, colorize
+
+SIZES = [1_000, 10_000]
+
+
+def loop_colorize(array, out_dtype=np.ubyte):
+    """Per category mask implementation previously used by `segmentation_to_image`."""
+    categories = np.unique(array)
+    image = np.empty((array.shape[0], array.shape[1], 3), dtype=out_dtype)
+    for category in categories:
+        mask = array == category
+        try:
+            image[mask] = CATEGORY_TO_RGB[category]
+        except KeyError:
+            warnings.warn(f"Category {category} not found")
+            image[mask] = (255, 255, 255)
+    return image
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda size: f"{size}x{size}")
+def segmentation(request):
+    rng = np.random.default_rng(0)
+    codes = np.fromiter(CATEGORY_TO_RGB, dtype=np.uint16)
+    # Blocks of 100x100 pixels to mimic the spatial structure of a real land cover map
+    size = request.param
+    blocks = rng.choice(codes, size=(size // 100, size // 100))
+    return np.kron(blocks, np.ones((100, 100), dtype=np.uint16))
+
+
+def bench_colorize_lut(benchmark, segmentation):
+    benchmark.group = f"colorize-{segmentation.shape[0]}"
+    image = benchmark.pedantic(colorize, args=(segmentation,), rounds=3, iterations=1)
+    assert image.shape == (*segmentation.shape, 3)
+
+
+def bench_colorize_loop(benchmark, segmentation):
+    benchmark.group = f"colorize-{segmentation.shape[0]}"
+    image = benchmark.pedantic(loop_colorize, args=(segmentation,), rounds=3, iterations=1)
+    np.testing.assert_array_equal(image[::97, ::97], colorize(segmentation[::97, ::97]))
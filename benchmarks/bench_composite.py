@@ -0,0 +1,24 @@
+import pytest
+from shapely import box, intersects
+
+from composite import composite
+
+AOI = (10.0, 48.0, 12.0, 50.0)
+
+
+@pytest.fixture(scope="module")
+def stack(catalog):
+    """Responses overlapping the area of the composite."""
+    indices = intersects(catalog.footprints, box(*AOI)).nonzero()[0]
+    return [catalog.response_v1(i) for i in indices]
+
+
+@pytest.mark.parametrize("chunk_size", [256, 1024])
+def bench_composite(benchmark, stack, chunk_size):
+    benchmark.group = "composite"
+    benchmark.pedantic(
+        composite,
+        args=(stack, AOI),
+        kwargs={"chunk_size": chunk_size},
+        rounds=3,
+    )
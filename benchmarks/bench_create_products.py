@@ -0,0 +1,54 @@
+"""Upload of the features of a GeoJSON file with `CreateProduct` to a local server."""
+import json
+
+import numpy as np
+import pytest
+from shapely import box, to_geojson
+
+from client import EarthSignatureClient, iter_product_requests
+from server import ServerConfig, build_services, serve_in_thread
+
+N_FEATURES = 200
+
+
+@pytest.fixture(scope="module")
+def services():
+    cfg = ServerConfig.from_environ({"SNAPEARTH_SERVER_PORT": "0", "SNAPEARTH_SERVER_SIZE": "64"})
+    services = build_services(cfg)
+    with serve_in_thread(cfg, services) as port:
+        yield services, port
+
+
+@pytest.fixture(scope="module")
+def geojson(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    xs, ys = rng.uniform(-10, 40, N_FEATURES), rng.uniform(35, 70, N_FEATURES)
+    features = [
+        {
+            "type": "Feature",
+            "geometry": json.loads(to_geojson(box(x, y, x + 1, y + 1))),
+            "properties": {"name": f"product_{i}", "cloud_cover": float(i % 100) / 100},
+        }
+        for i, (x, y) in enumerate(zip(xs, ys))
+    ]
+    path = tmp_path_factory.mktemp("geojson") / "products.geojson"
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    return path
+
+
+@pytest.mark.parametrize("window", [1, 8])
+def bench_create_products(benchmark, services, geojson, loop, window):
+    benchmark.group = "create_products"
+    (service, *_), port = services
+    client = EarthSignatureClient("127.0.0.1", port, use_ssl=False)
+
+    def upload():
+        created = service.created
+        uploaded = loop.run_until_complete(
+            client.create_products(iter_product_requests(geojson), window=window),
+        )
+        # Each request holds a single feature
+        assert uploaded == service.created - created == N_FEATURES
+
+    benchmark.pedantic(upload, rounds=3, iterations=1)
+    client.close()
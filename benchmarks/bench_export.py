@@ -0,0 +1,63 @@
+import asyncio
+
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from shapely import wkt
+
+from export import to_record_batch, write_geoparquet
+
+
+def dataframe_metadata(responses) -> pd.DataFrame:
+    """Table of the metadata built one message at a time."""
+    return pd.DataFrame(
+        [
+            {
+                "product_id": response.product_id,
+                "product_type": response.product_type,
+                "publication_date": response.publication_date.ToDatetime(),
+                "creation_date": response.creation_date.ToDatetime(),
+                "cloud_cover": response.cloud_cover,
+                "quicklook": response.quicklook,
+                "browse_url": response.browse_url,
+                "download_url": response.download_url,
+                "geometry": wkt.loads(response.wkt).wkb,
+            }
+            for response in responses
+        ],
+    )
+
+
+def bench_metadata_dataframe(benchmark, metadata_responses):
+    benchmark.group = "metadata"
+    benchmark(dataframe_metadata, metadata_responses)
+
+
+def bench_metadata_record_batch(benchmark, metadata_responses):
+    benchmark.group = "metadata"
+    batch = benchmark(to_record_batch, metadata_responses)
+    assert batch.num_rows == len(metadata_responses)
+
+
+def bench_write_geoparquet(benchmark, metadata_responses, tmp_path):
+    benchmark.group = "write_geoparquet"
+    path = tmp_path / "responses.parquet"
+    n_rows = benchmark(lambda: asyncio.run(write_geoparquet(metadata_responses, path)))
+    assert n_rows == len(metadata_responses)
+
+
+def bench_scan_messages(benchmark, metadata_responses):
+    benchmark.group = "scan"
+    benchmark(lambda: [r.product_id for r in metadata_responses if r.cloud_cover < 0.1])
+
+
+def bench_scan_geoparquet(benchmark, metadata_responses, tmp_path):
+    benchmark.group = "scan"
+    path = tmp_path / "responses.parquet"
+    asyncio.run(write_geoparquet(metadata_responses, path))
+
+    def scan():
+        table = pq.read_table(path, columns=["product_id", "cloud_cover"])
+        return table.filter(pc.less(table["cloud_cover"], 0.1))["product_id"]
+
+    benchmark(scan)
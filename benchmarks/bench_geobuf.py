@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import shapely
+
+from geobuf import decode, encode
+from server import encode_categories
+
+
+@pytest.fixture(scope="module", params=[64, 256], ids=lambda size: f"{size}px")
+def categories(request):
+    # Small blocks of random categories produce many dense polygons
+    rng = np.random.default_rng(0)
+    size = request.param
+    codes = np.array([111, 211, 311, 411, 511], dtype=np.uint16)
+    blocks = rng.choice(codes, (size // 4, size // 4))
+    labels = np.kron(blocks, np.ones((4, 4), dtype=np.uint16))
+    return encode_categories(labels, (0.0, 40.0, 1.0, 41.0))
+
+
+@pytest.fixture(scope="module")
+def mixed_geometries():
+    # Every supported type, with and without holes or several parts, and empty
+    wkts = [
+        "POINT (1 2)",
+        "POINT EMPTY",
+        "MULTIPOINT ((1 2), (3 4))",
+        "MULTIPOINT EMPTY",
+        "LINESTRING (0 0, 1 1, 2 0)",
+        "LINESTRING EMPTY",
+        "MULTILINESTRING ((0 0, 1 1), (2 2, 3 3))",
+        "MULTILINESTRING EMPTY",
+        "POLYGON ((0 0, 4 0, 4 4, 0 0), (1 0.5, 2 0.5, 2 1.5, 1 0.5))",
+        "POLYGON EMPTY",
+        "MULTIPOLYGON (((0 0, 1 0, 1 1, 0 0)), ((5 5, 6 5, 6 6, 5 5)))",
+        "MULTIPOLYGON EMPTY",
+    ]
+    return shapely.from_wkt(wkts * 100)
+
+
+def bench_decode_feature_collection(benchmark, categories):
+    benchmark.group = "geobuf_decode"
+    geometries, properties = benchmark(decode, categories)
+    assert len(geometries) == len(categories.feature_collection.features)
+
+
+def bench_encode_feature_collection(benchmark, categories):
+    benchmark.group = "geobuf_encode"
+    geometries, properties = decode(categories)
+    data = benchmark(encode, geometries, properties, precision=categories.precision)
+    assert data == categories
+
+
+def bench_roundtrip_mixed_geometries(benchmark, mixed_geometries):
+    benchmark.group = "geobuf_roundtrip"
+    geometries, _ = benchmark(lambda: decode(encode(mixed_geometries)))
+    assert (shapely.get_type_id(geometries) == shapely.get_type_id(mixed_geometries)).all()
+    assert shapely.equals_exact(geometries, mixed_geometries).all()
@@ -0,0 +1,73 @@
+"""Peak resident memory of decoding a response, each measure is run in a fresh process."""
+import mmap
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+import pytest
+from rasterio.io import MemoryFile
+
+from cache import BLOB_PREFIX, blob_path, is_blob_ref
+from server import to_geotiff
+from utils import CATEGORY_TO_RGB, BufferPool, read_inmemory
+
+CLEAR_REFS = Path("/proc/self/clear_refs")
+N_DECODES = 4
+pytestmark = pytest.mark.skipif(not CLEAR_REFS.exists(), reason="Peak RSS is reset through procfs")
+
+
+def copy_decode(data):
+    """Decode path previously used by `read_inmemory`."""
+    if is_blob_ref(data):
+        with open(blob_path(data), "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    with MemoryFile(data) as memfile:
+        with memfile.open() as dataset:
+            return dataset.read()
+
+
+def pooled_decode(data, pool=BufferPool()):
+    pool.release(read_inmemory(data, pool=pool))
+
+
+DECODERS = {"copy": copy_decode, "zero_copy": pooled_decode}
+
+
+def _peak_rss(decoder: str, path: str, blob: bool) -> float:
+    """Increase of the peak RSS in MiB while decoding the raster of `path` a few times."""
+    data = BLOB_PREFIX + path.encode() if blob else Path(path).read_bytes()
+    # Load GDAL before measuring
+    DECODERS[decoder](data)
+    # Reset the peak RSS to the current RSS
+    CLEAR_REFS.write_text("5")
+    status = dict(line.split(":", 1) for line in Path("/proc/self/status").read_text().splitlines())
+    before = int(status["VmRSS"].split()[0])
+    for _ in range(N_DECODES):
+        DECODERS[decoder](data)
+    status = dict(line.split(":", 1) for line in Path("/proc/self/status").read_text().splitlines())
+    return (int(status["VmHWM"].split()[0]) - before) / 1024
+
+
+@pytest.fixture(scope="module")
+def raster(server_config, tmp_path_factory):
+    # Random categories compress poorly, like the fine details of real land cover maps
+    rng = np.random.default_rng(0)
+    codes = np.fromiter(CATEGORY_TO_RGB, dtype=np.uint16)
+    labels = rng.choice(codes, (server_config.size, server_config.size))
+    path = tmp_path_factory.mktemp("blobs") / "segmentation.tif"
+    path.write_bytes(to_geotiff(labels, (0.0, 40.0, 1.0, 41.0)))
+    return str(path)
+
+
+@pytest.mark.parametrize("blob", [False, True], ids=["bytes", "blob"])
+@pytest.mark.parametrize("decoder", list(DECODERS))
+def bench_peak_rss(benchmark, raster, decoder, blob):
+    benchmark.group = "peak_rss"
+    context = multiprocessing.get_context("spawn")
+
+    def measure():
+        with context.Pool(1) as pool:
+            return pool.apply(_peak_rss, (decoder, raster, blob))
+
+    peak = benchmark.pedantic(measure, rounds=1, iterations=1)
+    benchmark.extra_info["peak_rss_mib"] = peak
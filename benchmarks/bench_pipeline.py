@@ -0,0 +1,162 @@
+"""Cost of each stage of `plot_responses`, then of the whole pipeline against a local server."""
+from datetime import date
+from types import SimpleNamespace
+
+import folium
+import pandas as pd
+import pytest
+import rasterio
+from shapely import wkt
+
+from client import EarthSignatureClient
+from mosaic import Mosaic
+from snapearth.api.v1.database_pb2 import ListSegmentationRequest
+from utils import (
+    EUROPE_COORDINATES,
+    POPUP_FIELDS,
+    build_executor,
+    display_shape,
+    plot_responses,
+    popup_html,
+    popups_html,
+    read_inmemory,
+    segmentation_to_image,
+    segmentation_to_png,
+)
+
+N_RESULTS = [1, 5, 10]
+
+
+@pytest.fixture(scope="module")
+def response(catalog):
+    return catalog.response_v1(0)
+
+
+def bench_read_inmemory(benchmark, response):
+    benchmark.group = "read_inmemory"
+    benchmark(read_inmemory, response.segmentation, dtype=rasterio.uint16)
+
+
+@pytest.mark.parametrize("zoom", [3, 8])
+def bench_read_inmemory_display(benchmark, response, zoom):
+    benchmark.group = "read_inmemory"
+    max_shape = display_shape(wkt.loads(response.wkt).bounds, zoom)
+    benchmark(read_inmemory, response.segmentation, dtype=rasterio.uint16, max_shape=max_shape)
+
+
+def bench_segmentation_to_image(benchmark, response):
+    benchmark.group = "segmentation_to_image"
+    benchmark(segmentation_to_image, response.segmentation, response.cloud_mask)
+
+
+def bench_wkt_loads(benchmark, response):
+    benchmark.group = "wkt_loads"
+    benchmark(wkt.loads, response.wkt)
+
+
+def dataframe_popup_html(response) -> str:
+    """Implementation previously used by `popup_html`."""
+    values = [
+        response.creation_date.ToDatetime(),
+        response.publication_date.ToDatetime(),
+        response.product_id,
+        response.quicklook,
+        response.cloud_cover,
+        response.browse_url,
+        response.download_url,
+    ]
+    df = pd.DataFrame({"names": POPUP_FIELDS, "values": values})
+    return df.to_html(
+        classes="table table-striped table-hover table-condensed table-responsive",
+    )
+
+
+def bench_popup_html(benchmark, metadata_responses):
+    benchmark.group = "popup_html"
+    benchmark(popup_html, metadata_responses[0])
+
+
+@pytest.mark.parametrize("n_responses", [100, 1000])
+def bench_popups_html(benchmark, metadata_responses, n_responses):
+    benchmark.group = f"popups_html_{n_responses}"
+    benchmark(popups_html, metadata_responses[:n_responses])
+
+
+@pytest.mark.parametrize("n_responses", [100, 1000])
+def bench_popups_dataframe(benchmark, metadata_responses, n_responses):
+    benchmark.group = f"popups_html_{n_responses}"
+    responses = metadata_responses[:n_responses]
+    benchmark(lambda: [dataframe_popup_html(response) for response in responses])
+
+
+def bench_image_overlay(benchmark, response):
+    benchmark.group = "image_overlay"
+    image = segmentation_to_image(response.segmentation, response.cloud_mask)
+    xmin, ymin, xmax, ymax = wkt.loads(response.wkt).bounds
+    # The image is encoded to a base64 PNG when the overlay is created
+    benchmark(folium.raster_layers.ImageOverlay, image, bounds=((ymin, xmin), (ymax, xmax)))
+
+
+def bench_image_overlay_png(benchmark, response):
+    benchmark.group = "image_overlay"
+    xmin, ymin, xmax, ymax = wkt.loads(response.wkt).bounds
+
+    def overlay():
+        url = segmentation_to_png(response.segmentation, response.cloud_mask)
+        return folium.raster_layers.ImageOverlay(url, bounds=((ymin, xmin), (ymax, xmax)))
+
+    benchmark(overlay)
+
+
+@pytest.mark.parametrize("n_results", N_RESULTS)
+def bench_fetch(benchmark, server_port, loop, n_results):
+    benchmark.group = "fetch"
+    client = EarthSignatureClient("127.0.0.1", server_port, use_ssl=False)
+    request = ListSegmentationRequest(n_results=n_results)
+    responses = benchmark(lambda: loop.run_until_complete(client.list_segmentation(request)))
+    client.close()
+    assert len(responses) == n_results
+
+
+@pytest.fixture(scope="module", params=["thread", "process"])
+def executor(request):
+    with build_executor(SimpleNamespace(executor=request.param, workers=0)) as executor:
+        yield executor
+
+
+def form(n_results):
+    widgets = {
+        "geom": "",
+        "start_date": date(2021, 1, 1),
+        "end_date": date(2022, 1, 1),
+        "product_ids": "",
+        "categories": "",
+        "n_results": n_results,
+    }
+    return {name: SimpleNamespace(value=value) for name, value in widgets.items()}
+
+
+@pytest.mark.parametrize("n_results", N_RESULTS)
+def bench_plot_responses(benchmark, server_port, executor, n_results):
+    benchmark.group = "plot_responses"
+    widgets = form(n_results)
+
+    def plot():
+        map_ = plot_responses("127.0.0.1", server_port, False, executor=executor, **widgets)
+        # Include the rendering of the map HTML sent to the notebook
+        return map_.get_root().render()
+
+    benchmark.pedantic(plot, rounds=3, iterations=1)
+
+
+@pytest.mark.parametrize("n_results", N_RESULTS)
+def bench_plot_responses_mosaic(benchmark, server_port, n_results):
+    benchmark.group = "plot_responses_mosaic"
+    widgets = form(n_results)
+
+    def plot():
+        mosaic = Mosaic(EUROPE_COORDINATES.bounds, zoom=3)
+        map_ = plot_responses("127.0.0.1", server_port, False, mosaic=mosaic, **widgets)
+        return map_.get_root().render()
+
+    benchmark.pedantic(plot, rounds=3, iterations=1)
@@ -0,0 +1,10 @@
+import pytest
+
+from stats import category_statistics
+
+
+@pytest.mark.parametrize("mask_clouds", [False, True], ids=["all", "clear"])
+def bench_category_statistics(benchmark, responses, mask_clouds):
+    benchmark.group = "category_statistics"
+    table = benchmark(category_statistics, responses, mask_clouds=mask_clouds)
+    assert set(table.index.get_level_values("product_id")) == {r.product_id for r in responses}
@@ -0,0 +1,40 @@
+from shapely import wkt
+
+from utils import read_inmemory
+from views import ResponseFilter, ResponseView
+
+PREDICATE = ResponseFilter(
+    max_cloud_cover=0.15,
+    intersects=wkt.loads("POLYGON ((-10 35, 30 35, 30 60, -10 60, -10 35))"),
+)
+
+
+def decode_then_filter(responses):
+    """Filtering after decoding every raster."""
+    return [
+        array
+        for response, array in ((r, read_inmemory(r.segmentation)[0]) for r in responses)
+        if PREDICATE(response)
+    ]
+
+
+def filter_then_decode(responses):
+    views = [ResponseView(response) for response in responses]
+    return [view.segmentation for view in views if PREDICATE(view)]
+
+
+def bench_decode_then_filter(benchmark, responses):
+    benchmark.group = "filtered_decode"
+    benchmark(decode_then_filter, responses)
+
+
+def bench_filter_then_decode(benchmark, responses):
+    benchmark.group = "filtered_decode"
+    kept = benchmark(filter_then_decode, responses)
+    assert 0 < len(kept) == len(decode_then_filter(responses)) < len(responses)
+
+
+def bench_response_filter(benchmark, metadata_responses):
+    benchmark.group = "response_filter"
+    responses = metadata_responses[:1000]
+    benchmark(lambda: [response for response in responses if PREDICATE(response)])
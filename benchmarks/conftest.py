@@ -0,0 +1,52 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from server import ServerConfig, SyntheticCatalog, serve_in_thread
+from snapearth.api.v1.database_pb2 import SegmentationResponse
+
+RASTER_SIZES = [256, 1024, 2048]
+N_RESPONSES = 20
+N_METADATA_RESPONSES = 10000
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session", params=RASTER_SIZES, ids=lambda size: f"{size}px")
+def server_config(request) -> ServerConfig:
+    return ServerConfig.from_environ(
+        {"SNAPEARTH_SERVER_PORT": "0", "SNAPEARTH_SERVER_SIZE": str(request.param)},
+    )
+
+
+@pytest.fixture(scope="session")
+def catalog(server_config) -> SyntheticCatalog:
+    return SyntheticCatalog(server_config)
+
+
+@pytest.fixture(scope="session")
+def responses(catalog) -> List[SegmentationResponse]:
+    """First responses of the catalog with their rasters."""
+    return [catalog.response_v1(i) for i in range(N_RESPONSES)]
+
+
+@pytest.fixture(scope="session")
+def metadata_responses() -> List[SegmentationResponse]:
+    """Responses without rasters, for the benchmarks which do not depend on the raster size."""
+    catalog = SyntheticCatalog(ServerConfig.from_environ({"SNAPEARTH_SERVER_PORT": "0"}))
+    n_products = len(catalog.product_ids)
+    return [
+        catalog._fill(SegmentationResponse(), i % n_products) for i in range(N_METADATA_RESPONSES)
+    ]
+
+
+@pytest.fixture(scope="session")
+def server_port(server_config):
+    with serve_in_thread(server_config) as port:
+        yield port
@@ -0,0 +1,379 @@
+import asyncio
+import hashlib
+import os
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import warnings
+from collections import Counter
+from concurrent.futures import Future
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, Set
+from urllib.parse import quote
+
+from google.protobuf.internal.decoder import _DecodeVarint32
+from google.protobuf.internal.encoder import _VarintBytes
+
+from snapearth.api.v1.database_pb2 import ListSegmentationRequest, SegmentationResponse
+
+# Prefix of the raster fields holding a reference to a blob instead of its content. It
+# holds a random token so that no raster received from the network is taken for a
+# reference, child processes share the token through the environment.
+BLOB_TOKEN = os.environ.setdefault("SNAPEARTH_BLOB_TOKEN", secrets.token_hex(16))
+BLOB_PREFIX = f"snapearth-blob:{BLOB_TOKEN}:".encode()
+RASTER_FIELDS = ("segmentation", "cloud_mask")
+
+
+def blob_refs(stored: SegmentationResponse) -> Set[str]:
+    """References of the blobs of a response returned by `BlobStore.reference`."""
+    return {getattr(stored, field).decode() for field in RASTER_FIELDS} - {""}
+
+
+def is_blob_ref(data) -> bool:
+    return isinstance(data, bytes) and data.startswith(BLOB_PREFIX)
+
+
+def blob_path(data: bytes) -> str:
+    """Location of the blob referenced by `data`."""
+    return os.fsdecode(data[len(BLOB_PREFIX) :])
+
+
+def blob_key(product_id: str, data: bytes) -> str:
+    """Reference of a raster in a `BlobStore`, its product and content hash."""
+    if is_blob_ref(data):
+        # Blobs are stored at `<directory>/<reference>`
+        return "/".join(Path(blob_path(data)).parts[-2:])
+    return f"{quote(product_id, safe='')}/{hashlib.sha256(data).hexdigest()}"
+
+
+class BlobStore:
+    """Content addressed store of raster blobs.
+
+    Blobs are stored once per product and content hash, so identical rasters returned by
+    overlapping queries share the same file.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, ref: str) -> Path:
+        return self.directory / ref
+
+    def put(self, product_id: str, data: bytes) -> str:
+        """Store `data` unless it is already present and return its reference.
+
+        `data` may reference a blob of another store, such as the one of the cache, which is
+        then hard linked so that both stores share the file, or copied across file systems.
+        """
+        ref = blob_key(product_id, data)
+        path = self.path(ref)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            if is_blob_ref(data):
+                try:
+                    os.link(blob_path(data), path)
+                    return ref
+                except FileExistsError:
+                    return ref
+                except OSError:
+                    # The stores are on different file systems
+                    pass
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                if is_blob_ref(data):
+                    with open(blob_path(data), "rb") as source:
+                        shutil.copyfileobj(source, file)
+                else:
+                    file.write(data)
+            os.replace(tmp_path, path)
+        return ref
+
+    def size(self, ref: str) -> int:
+        return self.path(ref).stat().st_size
+
+    def delete(self, ref: str):
+        path = self.path(ref)
+        path.unlink(missing_ok=True)
+        try:
+            path.parent.rmdir()
+        except OSError:
+            pass
+
+    def dereference(self, response: SegmentationResponse):
+        """Replace the blob references of a response read from the cache by their location."""
+        for field in RASTER_FIELDS:
+            data = getattr(response, field)
+            if data:
+                setattr(response, field, BLOB_PREFIX + bytes(self.path(data.decode())))
+
+    def reference(self, response: SegmentationResponse) -> SegmentationResponse:
+        """Copy of a response with its rasters moved to the store."""
+        stored = SegmentationResponse()
+        stored.CopyFrom(response)
+        for field in RASTER_FIELDS:
+            data = getattr(response, field)
+            if data:
+                setattr(stored, field, self.put(response.product_id, data).encode())
+        return stored
+
+
+def write_delimited(file, message):
+    data = message.SerializeToString()
+    file.write(_VarintBytes(len(data)))
+    file.write(data)
+
+
+def read_delimited(data: bytes, message_type=SegmentationResponse) -> Iterator:
+    position = 0
+    while position < len(data):
+        size, position = _DecodeVarint32(data, position)
+        yield message_type.FromString(data[position : position + size])
+        position += size
+
+
+def request_key(request: ListSegmentationRequest, namespace: str = "") -> str:
+    """Hash of the canonical serialization of a request."""
+    canonical = ListSegmentationRequest()
+    canonical.CopyFrom(request)
+    # The order of the product ids and categories does not change the result
+    canonical.product_ids[:] = sorted(request.product_ids)
+    canonical.categories[:] = sorted(request.categories)
+    digest = hashlib.sha256(namespace.encode())
+    digest.update(canonical.SerializeToString(deterministic=True))
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Persistent cache of `ListSegmentation` response streams.
+
+    Each stream is stored as length delimited `SegmentationResponse` messages in a file
+    named after the hash of the request, an SQLite index keeps track of the size and of
+    the creation and access time of the entries. Rasters are moved to a `BlobStore`
+    shared by all entries and read from their file.
+
+    Entries younger than `ttl` seconds are served from disk. Entries younger than
+    `ttl + stale_ttl` seconds are still served from disk but refreshed in the background,
+    on an event loop run by a thread of the cache so the refresh outlives the loop of the
+    caller. `fetch` must then be usable from any event loop, as `EarthSignatureClient` is.
+    When the cache is larger than `max_bytes`, least recently used entries are evicted.
+    """
+
+    def __init__(self, directory, max_bytes: int, ttl: float, stale_ttl: float = 0.0):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # The index is shared with the thread of the refreshes
+        self._index = sqlite3.connect(self.directory / "index.sqlite", check_same_thread=False)
+        self._lock = threading.RLock()
+        self._index.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, size INTEGER, created REAL, accessed REAL)",
+        )
+        self._index.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT, ref TEXT)")
+        self._index.execute("CREATE INDEX IF NOT EXISTS blobs_key ON blobs (key)")
+        self.blobs = BlobStore(self.directory / "blobs")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._refreshing: Dict[str, Future] = {}
+        # Number of streams being stored which use each blob
+        self._pending: Counter = Counter()
+
+    @classmethod
+    def from_config(cls, cfg) -> Optional["ResponseCache"]:
+        """Build a cache from a `DemoConfig.Cache` configuration, None if it is disabled."""
+        if not cfg.directory:
+            return None
+        return cls(cfg.directory, cfg.max_bytes, cfg.ttl, cfg.stale_ttl)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.pb"
+
+    def get(self, key: str):
+        """Return the cached responses and whether they are stale, None on a miss."""
+        with self._lock:
+            row = self._index.execute(
+                "SELECT created FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            now = time.time()
+            if row is None or now - row[0] > self.ttl + self.stale_ttl:
+                return None
+            try:
+                data = self._path(key).read_bytes()
+            except FileNotFoundError:
+                self._collect(self._delete(key))
+                return None
+            with self._index:
+                self._index.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            responses = list(read_delimited(data))
+            for response in responses:
+                self.blobs.dereference(response)
+            return responses, now - row[0] > self.ttl
+
+    def _refs(self, key: str) -> Set[str]:
+        rows = self._index.execute("SELECT ref FROM blobs WHERE key = ?", (key,))
+        return {ref for (ref,) in rows}
+
+    def _delete(self, key: str) -> Set[str]:
+        """Delete an entry and return the references of the blobs it was using."""
+        refs = self._refs(key)
+        self._path(key).unlink(missing_ok=True)
+        with self._index:
+            self._index.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._index.execute("DELETE FROM blobs WHERE key = ?", (key,))
+        return refs
+
+    def _collect(self, refs: Set[str]):
+        """Delete the blobs among `refs` which are not referenced by any entry anymore.
+
+        Blobs of the streams being stored are kept.
+        """
+        with self._lock:
+            referenced = {ref for (ref,) in self._index.execute("SELECT DISTINCT ref FROM blobs")}
+            for ref in refs - referenced - set(self._pending):
+                self.blobs.delete(ref)
+
+    def _commit(self, key: str, tmp_path: str, refs: Set[str]):
+        with self._lock:
+            # The entry may be refreshed, keep track of the blobs of its previous version
+            previous = self._delete(key)
+            os.replace(tmp_path, self._path(key))
+            now = time.time()
+            with self._index:
+                self._index.execute(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?)",
+                    (key, self._path(key).stat().st_size, now, now),
+                )
+                self._index.executemany(
+                    "INSERT INTO blobs VALUES (?, ?)",
+                    ((key, ref) for ref in refs),
+                )
+            self.evict(released=previous)
+
+    def evict(self, released: Set[str] = frozenset()):
+        """Remove expired entries then least recently used ones until under the byte budget.
+
+        Blobs which are not used anymore by the remaining entries are deleted as well as the
+        unused blobs among `released`.
+        """
+        with self._lock:
+            released = set(released)
+            expired = self._index.execute(
+                "SELECT key FROM entries WHERE created < ?",
+                (time.time() - self.ttl - self.stale_ttl,),
+            ).fetchall()
+            for (key,) in expired:
+                released |= self._delete(key)
+            rows = self._index.execute("SELECT key, size FROM entries ORDER BY accessed DESC")
+            total = 0
+            counted = set()
+            for key, size in rows.fetchall():
+                refs = self._refs(key)
+                # Blobs shared with more recently used entries are already accounted for
+                total += size + sum(self.blobs.size(ref) for ref in refs - counted)
+                counted |= refs
+                if total > self.max_bytes:
+                    released |= self._delete(key)
+            self._collect(released)
+
+    async def _store(self, key: str, responses: AsyncIterator) -> AsyncIterator:
+        """Yield the responses while writing them to the cache, kept only if fully consumed.
+
+        The responses are yielded with their rasters read from the blobs, as on a cache hit,
+        so a catalog links the blobs instead of copying them. The blobs of a stream which is
+        not fully consumed are deleted unless used elsewhere.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        complete = False
+        refs = set()
+        try:
+            with os.fdopen(fd, "wb") as file:
+                async for response in responses:
+                    # The blobs are marked as pending before they can be collected
+                    with self._lock:
+                        stored = self.blobs.reference(response)
+                        for field in RASTER_FIELDS:
+                            ref = getattr(stored, field).decode()
+                            if ref and ref not in refs:
+                                refs.add(ref)
+                                self._pending[ref] += 1
+                    write_delimited(file, stored)
+                    self.blobs.dereference(stored)
+                    yield stored
+            complete = True
+        finally:
+            with self._lock:
+                for ref in refs:
+                    self._pending[ref] -= 1
+                    if not self._pending[ref]:
+                        del self._pending[ref]
+                if complete:
+                    self._commit(key, tmp_path, refs)
+                else:
+                    os.unlink(tmp_path)
+                    self._collect(refs)
+
+    async def _refresh(self, key: str, fetch: Callable[[], AsyncIterator]):
+        try:
+            async for _ in self._store(key, fetch()):
+                pass
+        except Exception as exc:
+            # The stale entry is still served, it will be refreshed on the next hit
+            warnings.warn(f"Could not refresh cache entry {key}: {exc!r}")
+
+    def _start_refresh(self, key: str, fetch: Callable[[], AsyncIterator]):
+        """Refresh an entry on the loop of the cache unless it is already being refreshed."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="cache-refresh",
+                    daemon=True,
+                ).start()
+            future = asyncio.run_coroutine_threadsafe(self._refresh(key, fetch), self._loop)
+            self._refreshing[key] = future
+        future.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    def wait_refreshed(self, timeout: Optional[float] = None):
+        """Block until the background refreshes of stale entries are complete."""
+        while self._refreshing:
+            for future in list(self._refreshing.values()):
+                future.result(timeout)
+
+    async def stream(
+        self,
+        request: ListSegmentationRequest,
+        fetch: Callable[[], AsyncIterator],
+        namespace: str = "",
+    ) -> AsyncIterator[SegmentationResponse]:
+        """Serve the responses of `request` from the cache, calling `fetch` on a miss.
+
+        Stale responses are served right away, the refresh does not delay the caller.
+        """
+        key = request_key(request, namespace)
+        cached = self.get(key)
+        if cached is None:
+            async for response in self._store(key, fetch()):
+                yield response
+            return
+        responses, stale = cached
+        if stale:
+            self._start_refresh(key, fetch)
+        for response in responses:
+            yield response
+
+    def close(self):
+        """Wait for the background refreshes, stop their loop and close the index."""
+        self.wait_refreshed()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+        self._index.close()
@@ -0,0 +1,355 @@
+"""Persistent local catalog of the received responses, queried offline.
+
+Products are indexed by an SQLite R-tree on the bounds of their footprint and a B-tree on
+their publication date. The catalog also records which area, date range and categories
+were fully returned by the server, so a request is answered locally and only the date
+ranges it does not cover yet are fetched.
+"""
+import sqlite3
+import time
+from pathlib import Path
+from typing import AsyncIterator, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+from shapely import wkt
+
+from cache import BlobStore, blob_refs
+from snapearth.api.v1.database_pb2 import ListSegmentationRequest, SegmentationResponse
+
+# Dates of the requests without a start or an end date, in nanoseconds
+MIN_DATE = np.iinfo(np.int64).min
+MAX_DATE = np.iinfo(np.int64).max
+
+
+def date_range(request: ListSegmentationRequest) -> Tuple[int, int]:
+    """Start and end dates of a request in nanoseconds."""
+    start = request.start_date.ToNanoseconds() if request.HasField("start_date") else MIN_DATE
+    end = request.end_date.ToNanoseconds() if request.HasField("end_date") else MAX_DATE
+    return start, end
+
+
+def categories_key(request: ListSegmentationRequest) -> str:
+    return ",".join(sorted(request.categories))
+
+
+def subtract_intervals(
+    start: int,
+    end: int,
+    intervals: Sequence[Tuple[int, int]],
+) -> List[Tuple[int, int]]:
+    """Parts of `[start, end]` not covered by the closed `intervals`, newest first."""
+    gaps = []
+    for covered_start, covered_end in sorted(intervals, reverse=True, key=lambda i: i[1]):
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_end < end:
+            gaps.append((covered_end + 1, end))
+        end = covered_start - 1
+        if end < start:
+            break
+    if end >= start:
+        gaps.append((start, end))
+    return gaps
+
+
+class Catalog:
+    """SQLite catalog of the responses in `directory`, their rasters moved to a `BlobStore`.
+
+    Requests filtered by categories are answered with the products received for the same
+    categories. Requests filtered by product ids are answered locally once every product
+    was received. Date ranges are fetched again `ttl` seconds after they were covered, the
+    server may have received new products since. When the rasters take more than
+    `max_bytes`, the least recently used products are evicted along with the coverage of
+    their dates.
+    """
+
+    def __init__(self, directory, max_bytes: int = 2**30, ttl: float = 24 * 3600):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.directory / "catalog.sqlite")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS products ("
+                "id INTEGER PRIMARY KEY, product_id TEXT UNIQUE, publication_date INTEGER, "
+                "wkt TEXT, message BLOB, size INTEGER, accessed REAL)",
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS products_date ON products (publication_date)",
+            )
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS footprints "
+                "USING rtree(id, xmin, xmax, ymin, ymax)",
+            )
+            # Products returned for each set of categories
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS matches ("
+                "id INTEGER, categories TEXT, PRIMARY KEY (categories, id))",
+            )
+            # Areas and date ranges fully returned by the server
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "categories TEXT, wkt TEXT, start_date INTEGER, end_date INTEGER, created REAL)",
+            )
+        self.blobs = BlobStore(self.directory / "blobs")
+
+    @classmethod
+    def from_config(cls, cfg) -> Optional["Catalog"]:
+        """Build a catalog from a `DemoConfig.Catalog` configuration, None if it is disabled."""
+        if not cfg.directory:
+            return None
+        return cls(cfg.directory, cfg.max_bytes, cfg.ttl)
+
+    def add(self, responses: Sequence[SegmentationResponse], categories: str = ""):
+        """Insert or update the responses, received for the `categories` key."""
+        now = time.time()
+        with self._db:
+            for response in responses:
+                stored = self.blobs.reference(response)
+                refs = blob_refs(stored)
+                previous = self._db.execute(
+                    "SELECT message FROM products WHERE product_id = ?",
+                    (response.product_id,),
+                ).fetchone()
+                # Updates keep the row id of the product and so its footprint in the R-tree
+                self._db.execute(
+                    "INSERT INTO products "
+                    "(product_id, publication_date, wkt, message, size, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (product_id) DO UPDATE SET "
+                    "publication_date = excluded.publication_date, wkt = excluded.wkt, "
+                    "message = excluded.message, size = excluded.size, "
+                    "accessed = excluded.accessed",
+                    (
+                        response.product_id,
+                        response.publication_date.ToNanoseconds(),
+                        response.wkt,
+                        stored.SerializeToString(),
+                        sum(self.blobs.size(ref) for ref in refs),
+                        now,
+                    ),
+                )
+                if previous is not None:
+                    # Blobs are keyed by product, the previous rasters are not used anymore
+                    for ref in blob_refs(SegmentationResponse.FromString(previous[0])) - refs:
+                        self.blobs.delete(ref)
+                (row_id,) = self._db.execute(
+                    "SELECT id FROM products WHERE product_id = ?",
+                    (response.product_id,),
+                ).fetchone()
+                xmin, ymin, xmax, ymax = wkt.loads(response.wkt).bounds
+                self._db.execute(
+                    "INSERT OR REPLACE INTO footprints VALUES (?, ?, ?, ?, ?)",
+                    (row_id, xmin, xmax, ymin, ymax),
+                )
+                self._db.execute(
+                    "INSERT OR IGNORE INTO matches VALUES (?, ?)",
+                    (row_id, categories),
+                )
+
+    def add_coverage(self, request: ListSegmentationRequest, start: int, end: int):
+        """Record that every product of `request` published in `[start, end]` is known."""
+        with self._db:
+            self._db.execute(
+                "INSERT INTO coverage VALUES (?, ?, ?, ?, ?)",
+                (categories_key(request), request.wkt, start, end, time.time()),
+            )
+
+    def gaps(self, request: ListSegmentationRequest) -> List[Tuple[int, int]]:
+        """Date ranges of a request, newest first, not covered by the catalog."""
+        start, end = date_range(request)
+        rows = self._db.execute(
+            "SELECT wkt, start_date, end_date FROM coverage "
+            "WHERE categories = ? AND start_date <= ? AND end_date >= ? AND created >= ?",
+            (categories_key(request), end, start, time.time() - self.ttl),
+        ).fetchall()
+        geometry = wkt.loads(request.wkt) if request.wkt else None
+        intervals = []
+        for covered_wkt, covered_start, covered_end in rows:
+            # Requests without an area of interest are only covered by such requests
+            if covered_wkt == "" or (
+                geometry is not None and wkt.loads(covered_wkt).covers(geometry)
+            ):
+                intervals.append((covered_start, covered_end))
+        return subtract_intervals(start, end, intervals)
+
+    def missing_products(self, request: ListSegmentationRequest) -> List[str]:
+        """Product ids of a request not received for its categories yet."""
+        product_ids = list(request.product_ids)
+        rows = self._db.execute(
+            "SELECT product_id FROM products JOIN matches USING (id) WHERE categories = ? "
+            f"AND product_id IN ({','.join('?' * len(product_ids))})",
+            (categories_key(request), *product_ids),
+        )
+        known = {product_id for (product_id,) in rows}
+        return [product_id for product_id in product_ids if product_id not in known]
+
+    def query(
+        self,
+        request: ListSegmentationRequest,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> List[SegmentationResponse]:
+        """Products of the catalog matching a request, newest first.
+
+        Candidates are selected from the indexes by the bounds of the area of interest and
+        the dates, then refined with an exact intersection test. `start` and `end` narrow the
+        date range of the request, in nanoseconds.
+        """
+        request_start, request_end = date_range(request)
+        start = request_start if start is None else max(start, request_start)
+        end = request_end if end is None else min(end, request_end)
+        sql = (
+            "SELECT products.wkt, message, id FROM products JOIN matches USING (id) "
+            "WHERE categories = ? AND publication_date BETWEEN ? AND ?"
+        )
+        params: list = [categories_key(request), start, end]
+        geometry = wkt.loads(request.wkt) if request.wkt else None
+        if geometry is not None:
+            xmin, ymin, xmax, ymax = geometry.bounds
+            sql += (
+                " AND id IN (SELECT id FROM footprints "
+                "WHERE xmin <= ? AND xmax >= ? AND ymin <= ? AND ymax >= ?)"
+            )
+            params += [xmax, xmin, ymax, ymin]
+        if request.product_ids:
+            sql += f" AND product_id IN ({','.join('?' * len(request.product_ids))})"
+            params += request.product_ids
+        sql += " ORDER BY publication_date DESC"
+        rows = self._db.execute(sql, params).fetchall()
+        if geometry is not None and rows:
+            shapely.prepare(geometry)
+            footprints = shapely.from_wkt([footprint for footprint, _, _ in rows])
+            rows = [row for row, hit in zip(rows, geometry.intersects(footprints)) if hit]
+        if request.n_results:
+            rows = rows[: request.n_results]
+        with self._db:
+            self._db.executemany(
+                "UPDATE products SET accessed = ? WHERE id = ?",
+                ((time.time(), row_id) for _, _, row_id in rows),
+            )
+        responses = [SegmentationResponse.FromString(message) for _, message, _ in rows]
+        for response in responses:
+            self.blobs.dereference(response)
+        return responses
+
+    def _remove(self, row_id: int):
+        """Delete a product and its blobs, the coverage of its date is not complete anymore."""
+        publication_date, message = self._db.execute(
+            "SELECT publication_date, message FROM products WHERE id = ?",
+            (row_id,),
+        ).fetchone()
+        self._db.execute(
+            "DELETE FROM coverage WHERE start_date <= ? AND end_date >= ? "
+            "AND categories IN (SELECT categories FROM matches WHERE id = ?)",
+            (publication_date, publication_date, row_id),
+        )
+        self._db.execute("DELETE FROM matches WHERE id = ?", (row_id,))
+        self._db.execute("DELETE FROM footprints WHERE id = ?", (row_id,))
+        self._db.execute("DELETE FROM products WHERE id = ?", (row_id,))
+        for ref in blob_refs(SegmentationResponse.FromString(message)):
+            self.blobs.delete(ref)
+
+    def evict(self):
+        """Drop the expired coverage, then the least recently used products over the budget."""
+        with self._db:
+            self._db.execute("DELETE FROM coverage WHERE created < ?", (time.time() - self.ttl,))
+            rows = self._db.execute("SELECT id, size FROM products ORDER BY accessed DESC")
+            total = 0
+            evicted = []
+            for row_id, size in rows.fetchall():
+                total += size
+                if total > self.max_bytes:
+                    evicted.append(row_id)
+            for row_id in evicted:
+                self._remove(row_id)
+
+    async def _fetch(
+        self,
+        request: ListSegmentationRequest,
+        fetch: Callable[[ListSegmentationRequest], AsyncIterator],
+    ) -> AsyncIterator[SegmentationResponse]:
+        """Fetch a request and add each response to the catalog as it is received."""
+        categories = categories_key(request)
+        async for response in fetch(request):
+            self.add([response], categories)
+            yield response
+
+    async def stream(
+        self,
+        request: ListSegmentationRequest,
+        fetch: Callable[[ListSegmentationRequest], AsyncIterator],
+    ) -> AsyncIterator[SegmentationResponse]:
+        """Answer a request from the catalog, calling `fetch` for the parts it does not cover.
+
+        Products are yielded newest first: the known ones between the uncovered date ranges
+        are read from the catalog, the ones of an uncovered range are yielded as they are
+        fetched, until `n_results` products were yielded. A fetched range cut short is only
+        covered from its oldest response. Requests filtered by product ids yield the fetched
+        products first, then the known ones. The catalog is evicted once the request is
+        answered.
+        """
+        async for response in self._stream(request, fetch):
+            yield response
+        self.evict()
+
+    async def _stream(
+        self,
+        request: ListSegmentationRequest,
+        fetch: Callable[[ListSegmentationRequest], AsyncIterator],
+    ) -> AsyncIterator[SegmentationResponse]:
+        # The server caps each fetched stream, so it is always consumed to the end
+        remaining = request.n_results or None
+        yielded = set()
+        newest = None
+        if request.product_ids:
+            missing = self.missing_products(request)
+            if missing:
+                missing_request = ListSegmentationRequest()
+                missing_request.CopyFrom(request)
+                missing_request.product_ids[:] = missing
+                async for response in self._fetch(missing_request, fetch):
+                    yielded.add(response.product_id)
+                    yield response
+        else:
+            newest = MAX_DATE
+            for start, end in self.gaps(request):
+                # Known products newer than the gap
+                for response in self.query(request, end + 1, newest)[:remaining]:
+                    yielded.add(response.product_id)
+                    yield response
+                if request.n_results:
+                    remaining = request.n_results - len(yielded)
+                    if not remaining:
+                        return
+                gap_request = ListSegmentationRequest()
+                gap_request.CopyFrom(request)
+                if start != MIN_DATE:
+                    gap_request.start_date.FromNanoseconds(start)
+                if end != MAX_DATE:
+                    gap_request.end_date.FromNanoseconds(end)
+                if request.n_results:
+                    gap_request.n_results = remaining
+                dates = []
+                async for response in self._fetch(gap_request, fetch):
+                    dates.append(response.publication_date.ToNanoseconds())
+                    yielded.add(response.product_id)
+                    yield response
+                if request.n_results and len(dates) >= remaining:
+                    self.add_coverage(request, min(dates), end)
+                    return
+                self.add_coverage(request, start, end)
+                newest = start - 1
+        known = [
+            response
+            for response in self.query(request, end=newest)
+            if response.product_id not in yielded
+        ]
+        if request.n_results:
+            known = known[: request.n_results - len(yielded)]
+        for response in known:
+            yield response
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,406 @@
+import asyncio
+import threading
+import warnings
+from datetime import datetime, timedelta
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from grpclib.client import Channel
+from grpclib.config import Configuration
+from grpclib.exceptions import StreamTerminatedError
+from shapely import box, intersection, wkt
+from shapely.geometry import shape
+from shapely.geometry.base import BaseGeometry
+
+from geobuf import encode, iter_geojson_features
+from snapearth.api.v1.database_grpc import DatabaseProductServiceStub
+from snapearth.api.v1.database_pb2 import (
+    CreateProductRequest,
+    CreateProductResponse,
+    ListSegmentationRequest,
+    SegmentationResponse,
+)
+
+# Errors meaning the underlying HTTP/2 connection is unusable
+CONNECTION_ERRORS = (ConnectionError, StreamTerminatedError, OSError)
+_DONE = object()
+
+
+def split_geometry(geom: BaseGeometry, rows: int, cols: int) -> List[BaseGeometry]:
+    """Split a geometry along a regular grid laid over its bounds, dropping cells outside of it."""
+    xmin, ymin, xmax, ymax = geom.bounds
+    xs = np.linspace(xmin, xmax, cols + 1)
+    ys = np.linspace(ymin, ymax, rows + 1)
+    cells = box(xs[:-1, None], ys[None, :-1], xs[1:, None], ys[None, 1:]).ravel()
+    tiles = intersection(cells, geom)
+    return [tile for tile in tiles if tile.area > 0]
+
+
+async def to_async_iterator(iterable: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    """Iterate asynchronously over a synchronous or an asynchronous iterable."""
+    if hasattr(iterable, "__aiter__"):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+async def _pump(stream: AsyncIterator, queue: asyncio.Queue, semaphore: asyncio.Semaphore):
+    try:
+        async with semaphore:
+            async for item in stream:
+                await queue.put(item)
+    except Exception as exc:
+        await queue.put(exc)
+    await queue.put(_DONE)
+
+
+async def merge_streams(streams: List[AsyncIterator], concurrency: int) -> AsyncIterator:
+    """Consume at most `concurrency` streams at once and yield their items as they arrive."""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.create_task(_pump(stream, queue, semaphore)) for stream in streams]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class EarthSignatureClient:
+    """Long lived client sharing a small pool of channels between requests.
+
+    Channels are opened lazily, reused across calls and each new call is sent on the
+    channel with the fewest in flight streams. A channel is only replaced when its
+    connection breaks. Connections are bound to an event loop, each loop has its own pool
+    which is closed with the loop.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        use_ssl: bool,
+        pool_size: int = 2,
+        keepalive_time: Optional[float] = None,
+        keepalive_timeout: float = 20.0,
+        max_concurrent_streams: int = 4,
+    ):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.pool_size = pool_size
+        self.max_concurrent_streams = max_concurrent_streams
+        self.config = Configuration(
+            http2_connection_window_size=2000000000,
+            http2_stream_window_size=2000000000,
+            # Pings are only sent every `keepalive_time` seconds when it is set
+            _keepalive_time=keepalive_time,
+            _keepalive_timeout=keepalive_timeout,
+        )
+        # Number of in flight streams of the channels of each event loop
+        self._pools: Dict[asyncio.AbstractEventLoop, Dict[Channel, int]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg, pool_size: int = 2) -> "EarthSignatureClient":
+        """Build a client from a `DemoConfig.GRPC` configuration."""
+        return cls(
+            cfg.host,
+            cfg.port,
+            cfg.use_ssl,
+            pool_size=pool_size,
+            keepalive_time=cfg.keepalive_time_ms / 1000,
+            keepalive_timeout=cfg.keepalive_timeout_ms / 1000,
+            max_concurrent_streams=cfg.max_concurrent_streams,
+        )
+
+    def _acquire(self) -> Channel:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for closed in [other for other in self._pools if other.is_closed()]:
+                for channel in list(self._pools[closed]):
+                    self._discard(channel)
+                del self._pools[closed]
+            pool = self._pools.setdefault(loop, {})
+            if len(pool) < self.pool_size:
+                channel = Channel(
+                    host=self.host,
+                    port=self.port,
+                    ssl=self.use_ssl,
+                    config=self.config,
+                )
+                pool[channel] = 0
+            else:
+                channel = min(pool, key=pool.__getitem__)
+            pool[channel] += 1
+        return channel
+
+    def _release(self, channel: Channel, broken: bool = False):
+        with self._lock:
+            for pool in self._pools.values():
+                if channel in pool:
+                    pool[channel] -= 1
+                    if broken:
+                        self._discard(channel)
+                    return
+
+    def _discard(self, channel: Channel):
+        for pool in self._pools.values():
+            pool.pop(channel, None)
+        try:
+            channel.close()
+        except RuntimeError:
+            # The event loop owning the connection is already closed
+            pass
+
+    async def list_segmentation(
+        self,
+        request: ListSegmentationRequest,
+        retries: int = 1,
+    ) -> List[SegmentationResponse]:
+        channel = self._acquire()
+        broken = False
+        try:
+            return await DatabaseProductServiceStub(channel).ListSegmentation(request)
+        except CONNECTION_ERRORS:
+            broken = True
+            if retries <= 0:
+                raise
+        finally:
+            self._release(channel, broken=broken)
+        # A pooled connection may have been dropped while idle, retry on a fresh one
+        return await self.list_segmentation(request, retries=retries - 1)
+
+    async def create_product(self, request: CreateProductRequest) -> CreateProductResponse:
+        channel = self._acquire()
+        broken = False
+        try:
+            # Not retried, the product may have been created before the connection broke
+            return await DatabaseProductServiceStub(channel).CreateProduct(request)
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self._release(channel, broken=broken)
+
+    async def create_products(
+        self,
+        requests: Union[Iterable[CreateProductRequest], AsyncIterable[CreateProductRequest]],
+        window: Optional[int] = None,
+    ) -> int:
+        """Upload products concurrently with at most `window` requests in flight.
+
+        The next request is only taken from `requests` once a slot is free, so a large
+        input is streamed instead of being read at once. Return the number of products
+        uploaded, the first failed upload is raised.
+        """
+        slots = asyncio.Semaphore(window or self.max_concurrent_streams)
+        pending: Set[asyncio.Task] = set()
+        uploaded = 0
+
+        async def upload(request):
+            try:
+                await self.create_product(request)
+            finally:
+                slots.release()
+
+        try:
+            async for request in to_async_iterator(requests):
+                await slots.acquire()
+                done = {task for task in pending if task.done()}
+                pending -= done
+                for task in done:
+                    task.result()
+                    uploaded += 1
+                pending.add(asyncio.create_task(upload(request)))
+            await asyncio.gather(*pending)
+            uploaded += len(pending)
+        finally:
+            for task in pending:
+                task.cancel()
+        return uploaded
+
+    async def stream_segmentation(
+        self,
+        request: ListSegmentationRequest,
+    ) -> AsyncIterator[SegmentationResponse]:
+        """Yield the responses of a `ListSegmentation` call as soon as they are received."""
+        channel = self._acquire()
+        broken = False
+        try:
+            method = DatabaseProductServiceStub(channel).ListSegmentation
+            async with method.open() as stream:
+                await stream.send_message(request, end=True)
+                async for response in stream:
+                    yield response
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self._release(channel, broken=broken)
+
+    async def stream_tiled_segmentation(
+        self,
+        request: ListSegmentationRequest,
+        rows: int,
+        cols: int,
+    ) -> AsyncIterator[SegmentationResponse]:
+        """Split the area of interest in a grid of `rows` x `cols` tiles queried concurrently.
+
+        At most `max_concurrent_streams` tiles are queried at once, the responses are
+        yielded as they arrive and a product overlapping several tiles is only yielded once.
+        Note that `n_results` applies to each tile. Requests without an area of interest or
+        with one that has no area are sent unsplit.
+        """
+        tiles = split_geometry(wkt.loads(request.wkt), rows, cols) if request.wkt else []
+        if not tiles:
+            async for response in self.stream_segmentation(request):
+                yield response
+            return
+        streams = []
+        for tile in tiles:
+            tile_request = ListSegmentationRequest()
+            tile_request.CopyFrom(request)
+            tile_request.wkt = tile.wkt
+            streams.append(self.stream_segmentation(tile_request))
+        seen = set()
+        async for response in merge_streams(streams, self.max_concurrent_streams):
+            if response.product_id not in seen:
+                seen.add(response.product_id)
+                yield response
+
+    async def _fetch_window(
+        self,
+        request: ListSegmentationRequest,
+        start: datetime,
+        end: datetime,
+        semaphore: asyncio.Semaphore,
+        min_window: timedelta,
+    ) -> List[SegmentationResponse]:
+        window_request = ListSegmentationRequest()
+        window_request.CopyFrom(request)
+        window_request.start_date.FromDatetime(start)
+        window_request.end_date.FromDatetime(end)
+        async with semaphore:
+            responses = await self.list_segmentation(window_request)
+        if not request.n_results or len(responses) < request.n_results:
+            return responses
+        if end - start <= min_window:
+            warnings.warn(f"Window {start} - {end} still capped by n_results={request.n_results}")
+            return responses
+        # The window was truncated, bisect it and query both halves instead
+        middle = start + (end - start) / 2
+        halves = await asyncio.gather(
+            self._fetch_window(request, start, middle, semaphore, min_window),
+            self._fetch_window(request, middle, end, semaphore, min_window),
+        )
+        return halves[0] + halves[1]
+
+    async def stream_sharded_segmentation(
+        self,
+        request: ListSegmentationRequest,
+        windows: int,
+        min_window: timedelta = timedelta(days=1),
+    ) -> AsyncIterator[SegmentationResponse]:
+        """Split the date range of the request in `windows` windows queried concurrently.
+
+        Windows returning exactly `n_results` responses may have been truncated, they are
+        bisected and queried again until no window is capped or they are shorter than
+        `min_window`. Note that `n_results` applies to each window.
+        Responses are yielded once, ordered by publication date.
+        """
+        start = request.start_date.ToDatetime()
+        end = request.end_date.ToDatetime()
+        bounds = [start + (end - start) * i / windows for i in range(windows + 1)]
+        semaphore = asyncio.Semaphore(self.max_concurrent_streams)
+        tasks = [
+            asyncio.create_task(
+                self._fetch_window(request, window_start, window_end, semaphore, min_window),
+            )
+            for window_start, window_end in zip(bounds[:-1], bounds[1:])
+        ]
+        seen = set()
+        try:
+            # Windows are chronological, yield each one as soon as all previous ones are done
+            for task in tasks:
+                responses = await task
+                responses.sort(key=lambda response: response.publication_date.ToNanoseconds())
+                for response in responses:
+                    if response.product_id not in seen:
+                        seen.add(response.product_id)
+                        yield response
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                for channel in list(pool):
+                    self._discard(channel)
+            self._pools.clear()
+
+    async def __aenter__(self) -> "EarthSignatureClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+_CLIENTS: Dict[Tuple[str, int, bool], EarthSignatureClient] = {}
+
+
+def get_client(host: str, port: int, use_ssl: bool) -> EarthSignatureClient:
+    """Return the client shared by every request sent to the same endpoint."""
+    key = (host, port, use_ssl)
+    if key not in _CLIENTS:
+        _CLIENTS[key] = EarthSignatureClient(host, port, use_ssl)
+    return _CLIENTS[key]
+
+
+def _product_request(features: List[dict], precision: int) -> CreateProductRequest:
+    data = encode(
+        [shape(feature["geometry"]) for feature in features],
+        [feature.get("properties") or {} for feature in features],
+        precision=precision,
+    )
+    return CreateProductRequest(data=data)
+
+
+def iter_product_requests(
+    path,
+    batch_size: int = 1,
+    precision: int = 6,
+) -> Iterator[CreateProductRequest]:
+    """Stream `CreateProductRequest`s from a GeoJSON file, each holding `batch_size` features."""
+    batch = []
+    for feature in iter_geojson_features(path):
+        batch.append(feature)
+        if len(batch) == batch_size:
+            yield _product_request(batch, precision)
+            batch = []
+    if batch:
+        yield _product_request(batch, precision)
@@ -0,0 +1,132 @@
+"""Cloud free land cover composite of a stack of responses over the same area.
+
+Each pixel takes the category of the most recent response in which it is covered and not
+cloudy. The output grid is processed in chunks and the responses from the most recent to
+the oldest, so the memory used does not depend on the number of responses and older
+responses are not read once every pixel of a chunk is filled.
+"""
+from contextlib import ExitStack
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import calculate_default_transform, transform_bounds
+from rasterio.windows import Window
+from rasterio.windows import bounds as window_bounds
+from shapely import wkt
+
+from snapearth.api.v1.database_pb2 import SegmentationResponse
+from utils import open_raster
+
+# Value of the pixels which are cloudy or not covered in every response
+NODATA = np.iinfo(np.uint16).max
+
+
+def _open(stack: ExitStack, data, crs, transform: Affine, width: int, height: int):
+    dataset = stack.enter_context(open_raster(data))
+    return stack.enter_context(
+        WarpedVRT(
+            dataset,
+            crs=crs,
+            transform=transform,
+            width=width,
+            height=height,
+            resampling=Resampling.nearest,
+            add_alpha=True,
+        ),
+    )
+
+
+def native_resolution(responses: Sequence[SegmentationResponse], crs=None) -> float:
+    """Finest pixel size of the segmentations, in `crs` units when given."""
+    resolutions = []
+    for response in responses:
+        with open_raster(response.segmentation) as dataset:
+            if crs is None:
+                resolutions.append(min(dataset.res))
+            else:
+                transform, _, _ = calculate_default_transform(
+                    dataset.crs,
+                    crs,
+                    dataset.width,
+                    dataset.height,
+                    *dataset.bounds,
+                )
+                resolutions.append(min(abs(transform.a), abs(transform.e)))
+    return min(resolutions)
+
+
+def composite(
+    responses: Sequence[SegmentationResponse],
+    bounds: Tuple[float, float, float, float],
+    resolution: Optional[float] = None,
+    crs: str = "EPSG:4326",
+    chunk_size: int = 512,
+) -> Tuple[np.ndarray, Affine]:
+    """Composite of `responses` over `bounds`, return the categories and their transform.
+
+    `bounds` and `resolution` are in `crs` units. The grid has the finest resolution of the
+    segmentations in `crs` unless `resolution` is given. The cloud masks are read at the resolution of the grid with nearest resampling,
+    responses without a cloud mask are considered clear. Pixels without any clear
+    observation are set to `NODATA`.
+    """
+    responses = sorted(responses, key=lambda response: response.publication_date.ToNanoseconds())
+    responses = responses[::-1]
+    if resolution is None:
+        resolution = native_resolution(responses, crs)
+    xmin, ymin, xmax, ymax = bounds
+    width = max(1, int(np.ceil((xmax - xmin) / resolution)))
+    height = max(1, int(np.ceil((ymax - ymin) / resolution)))
+    transform = Affine(resolution, 0.0, xmin, 0.0, -resolution, ymax)
+    result = np.full((height, width), NODATA, dtype=np.uint16)
+    # Footprints are longitude and latitude, they are compared with the chunks in `crs`
+    footprints = np.array(
+        [
+            transform_bounds("EPSG:4326", crs, *wkt.loads(response.wkt).bounds)
+            for response in responses
+        ],
+    )
+
+    with ExitStack() as stack:
+        segmentations: List[WarpedVRT] = []
+        cloud_masks: List[Optional[WarpedVRT]] = []
+        for response in responses:
+            segmentations.append(
+                _open(stack, response.segmentation, crs, transform, width, height),
+            )
+            cloud_masks.append(
+                _open(stack, response.cloud_mask, crs, transform, width, height)
+                if response.cloud_mask
+                else None,
+            )
+        for row in range(0, height, chunk_size):
+            for col in range(0, width, chunk_size):
+                window = Window(
+                    col,
+                    row,
+                    min(chunk_size, width - col),
+                    min(chunk_size, height - row),
+                )
+                left, bottom, right, top = window_bounds(window, transform)
+                overlaps = np.flatnonzero(
+                    (footprints[:, 0] < right)
+                    & (footprints[:, 2] > left)
+                    & (footprints[:, 1] < top)
+                    & (footprints[:, 3] > bottom),
+                )
+                chunk = result[window.toslices()]
+                missing = np.ones(chunk.shape, dtype=bool)
+                for index in overlaps:
+                    categories, alpha = segmentations[index].read(window=window)
+                    clear = missing & (alpha > 0)
+                    if cloud_masks[index] is not None:
+                        cloudy, _ = cloud_masks[index].read(window=window, out_dtype=rasterio.ubyte)
+                        clear &= cloudy == 0
+                    chunk[clear] = categories[clear]
+                    missing &= ~clear
+                    if not missing.any():
+                        break
+    return result, transform
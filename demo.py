@@ -18,8 +18,14 @@ import nest_asyncio
 from IPython.display import clear_output, display
 from ipywidgets.widgets.widget_box import GridBox, HBox
 from ipywidgets.widgets.widget_layout import Layout
+from shapely import wkt
 
-from utils import EUROPE_COORDINATES, DemoConfig, plot_responses
+from cache import ResponseCache
+from catalog import Catalog
+from client import EarthSignatureClient
+from mosaic import Mosaic
+from tiles import TileServer
+from utils import EUROPE_COORDINATES, DemoConfig, build_executor, plot_responses
 
 nest_asyncio.apply()
 
@@ -31,8 +37,16 @@ cfg: DemoConfig = DemoConfig.from_environ(
         "SNAPEARTH_GRPC_KEEPALIVE_TIMEOUT_MS": 60000,
         "SNAPEARTH_GRPC_MAX_RECEIVE_MESSAGE_LENGTH": 10**20,
         "SNAPEARTH_GRPC_MAX_SEND_MESSAGE_LENGTH": 10**20,
+        "SNAPEARTH_CACHE_DIRECTORY": ".snapearth_cache",
+        # Keep the responses in a local catalog, queried before the server
+        # "SNAPEARTH_CATALOG_DIRECTORY": ".snapearth_catalog",
     },
 )
+cache = ResponseCache.from_config(cfg.cache)
+catalog = Catalog.from_config(cfg.catalog)
+client = EarthSignatureClient.from_config(cfg.grpc)
+executor = build_executor(cfg.decode)
+tiles = TileServer.from_config(cfg.tiles)
 
 style = {"description_width": "initial"}
 geom = widgets.Text(
@@ -78,6 +92,19 @@ n_results = widgets.IntSlider(
     disabled=False,
 )
 
+overlap = widgets.Dropdown(
+    options=[
+        ("Overlay each product", ""),
+        ("Mosaic, latest product wins", "latest"),
+        ("Mosaic, lowest cloud cover wins", "cloud_cover"),
+    ],
+    value="",
+    description="Overlapping products",
+    # Tiles already render a single layer
+    disabled=tiles is not None,
+    style=style,
+)
+
 submit = widgets.Button(description="Submit")
 output = widgets.Output()
 
@@ -85,7 +112,11 @@ output = widgets.Output()
 def on_click(_):
     output.clear_output()
     with output:
-        map_ = plot_responses(
+        mosaic = None
+        if overlap.value:
+            bounds = wkt.loads(geom.value).bounds if geom.value else EUROPE_COORDINATES.bounds
+            mosaic = Mosaic(bounds, zoom=3, rule=overlap.value)
+        plot_responses(
             cfg.grpc.host,
             cfg.grpc.port,
             cfg.grpc.use_ssl,
@@ -95,15 +126,21 @@ def on_click(_):
             product_ids,
             categories,
             n_results,
+            incremental=True,
+            cache=cache,
+            catalog=catalog,
+            client=client,
+            executor=executor,
+            tiles=tiles,
+            mosaic=mosaic,
         )
-        display(map_)
 
 
 submit.on_click(on_click)
 
 # %%
 form = widgets.VBox(
-    children=[geom, start_date, end_date, product_ids, categories, n_results, submit],
+    children=[geom, start_date, end_date, product_ids, categories, n_results, overlap, submit],
 )
 display(
     GridBox(
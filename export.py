@@ -0,0 +1,170 @@
+"""Columnar export of the metadata of the responses to Arrow and GeoParquet.
+
+Each batch of responses becomes an Arrow record batch with the footprints encoded as WKB,
+so the catalog can be scanned with columnar tools instead of one message at a time.
+The rasters are kept out of the table, their columns hold the key of the raster in a
+`BlobStore`: the product id and the hash of its content.
+"""
+import json
+from typing import AsyncIterable, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+from cache import RASTER_FIELDS, BlobStore, blob_key
+from client import to_async_iterator
+from snapearth.api.v1.database_pb2 import SegmentationResponse
+
+GEOMETRY_COLUMN = "geometry"
+SCHEMA = pa.schema(
+    [
+        ("product_id", pa.string()),
+        ("product_type", pa.string()),
+        ("publication_date", pa.timestamp("ns", tz="UTC")),
+        ("creation_date", pa.timestamp("ns", tz="UTC")),
+        ("cloud_cover", pa.float32()),
+        ("quicklook", pa.string()),
+        ("browse_url", pa.string()),
+        ("download_url", pa.string()),
+        ("segmentation", pa.string()),
+        ("cloud_mask", pa.string()),
+        (GEOMETRY_COLUMN, pa.binary()),
+    ],
+)
+# Footprints are longitude and latitude, the default CRS of GeoParquet
+GEO_METADATA = {
+    "version": "1.0.0",
+    "primary_column": GEOMETRY_COLUMN,
+    "columns": {GEOMETRY_COLUMN: {"encoding": "WKB", "geometry_types": []}},
+}
+GEOPARQUET_SCHEMA = SCHEMA.with_metadata({"geo": json.dumps(GEO_METADATA)})
+
+
+def raster_key(
+    product_id: str,
+    data: bytes,
+    blobs: Optional[BlobStore] = None,
+) -> Optional[str]:
+    """Key of a raster, it is stored in `blobs` when given. None if there is no raster."""
+    if not data:
+        return None
+    if blobs is not None:
+        return blobs.put(product_id, data)
+    return blob_key(product_id, data)
+
+
+def raster_keys(
+    response: SegmentationResponse,
+    blobs: Optional[BlobStore] = None,
+) -> Tuple[Optional[str], ...]:
+    """Key of each raster field of a response."""
+    return tuple(
+        raster_key(response.product_id, getattr(response, field), blobs) for field in RASTER_FIELDS
+    )
+
+
+def without_rasters(response: SegmentationResponse) -> SegmentationResponse:
+    """Copy of a response holding only its metadata."""
+    metadata = SegmentationResponse()
+    metadata.CopyFrom(response)
+    for field in RASTER_FIELDS:
+        metadata.ClearField(field)
+    return metadata
+
+
+def to_record_batch(
+    responses: Sequence[SegmentationResponse],
+    blobs: Optional[BlobStore] = None,
+    keys: Optional[Sequence[Tuple[Optional[str], ...]]] = None,
+) -> pa.RecordBatch:
+    """Record batch of the metadata of `responses` with the `SCHEMA` schema.
+
+    The `raster_keys` of the responses are computed unless given as `keys`.
+    """
+    if keys is None:
+        keys = [raster_keys(response, blobs) for response in responses]
+    columns = {
+        "product_id": [response.product_id for response in responses],
+        "product_type": [response.product_type for response in responses],
+        "publication_date": np.array(
+            [response.publication_date.ToNanoseconds() for response in responses],
+            dtype=np.int64,
+        ),
+        "creation_date": np.array(
+            [response.creation_date.ToNanoseconds() for response in responses],
+            dtype=np.int64,
+        ),
+        "cloud_cover": np.array(
+            [response.cloud_cover for response in responses],
+            dtype=np.float32,
+        ),
+        "quicklook": [response.quicklook for response in responses],
+        "browse_url": [response.browse_url for response in responses],
+        "download_url": [response.download_url for response in responses],
+        GEOMETRY_COLUMN: shapely.to_wkb(
+            shapely.from_wkt([response.wkt for response in responses]),
+        ),
+    }
+    for index, field in enumerate(RASTER_FIELDS):
+        columns[field] = [response_keys[index] for response_keys in keys]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(columns[field.name], type=field.type) for field in SCHEMA],
+        schema=SCHEMA,
+    )
+
+
+class GeoParquetWriter:
+    """Append batches of responses to a GeoParquet file."""
+
+    def __init__(self, path, blobs: Optional[BlobStore] = None, **kwargs):
+        self.blobs = blobs
+        self.n_rows = 0
+        self._writer = pq.ParquetWriter(path, GEOPARQUET_SCHEMA, **kwargs)
+
+    def write(
+        self,
+        responses: Sequence[SegmentationResponse],
+        keys: Optional[Sequence[Tuple[Optional[str], ...]]] = None,
+    ):
+        """Write the responses as a row group, see `to_record_batch`."""
+        if not responses:
+            return
+        batch = to_record_batch(responses, self.blobs, keys)
+        self._writer.write_batch(batch)
+        self.n_rows += batch.num_rows
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self) -> "GeoParquetWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+async def write_geoparquet(
+    responses: Union[Iterable[SegmentationResponse], AsyncIterable[SegmentationResponse]],
+    path,
+    batch_size: int = 1024,
+    blobs: Optional[BlobStore] = None,
+) -> int:
+    """Write a stream of responses to GeoParquet by batches and return the number of rows.
+
+    The rasters of each response are keyed, and stored in `blobs` when given, as soon as
+    it is received. Only the metadata of a batch is then held in memory until the batch
+    is written as a row group.
+    """
+    with GeoParquetWriter(path, blobs) as writer:
+        batch: List[SegmentationResponse] = []
+        keys: List[Tuple[Optional[str], ...]] = []
+        async for response in to_async_iterator(responses):
+            keys.append(raster_keys(response, blobs))
+            batch.append(without_rasters(response))
+            if len(batch) >= batch_size:
+                writer.write(batch, keys)
+                batch, keys = [], []
+        writer.write(batch, keys)
+    return writer.n_rows
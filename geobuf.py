@@ -0,0 +1,339 @@
+"""Encoding and decoding of `geobufproto.Data` messages from and to shapely geometries.
+
+Coordinates are quantized with `10 ** precision` and each line or ring is delta encoded
+without its closing point (see https://github.com/mapbox/geobuf). A feature collection
+is processed at once: the coordinates of every feature are concatenated, quantized and
+delta encoded or decoded with NumPy and the geometries are built or flattened with the
+vectorized shapely functions.
+"""
+import json
+import re
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+
+from geobufproto.geobuf_pb2 import Data
+
+GeometryType = Data.Geometry.Type
+# Geobuf geometry type of each shapely geometry type id
+SHAPELY_TYPES = {
+    shapely.GeometryType.POINT: GeometryType.POINT,
+    shapely.GeometryType.LINESTRING: GeometryType.LINESTRING,
+    shapely.GeometryType.POLYGON: GeometryType.POLYGON,
+    shapely.GeometryType.MULTIPOINT: GeometryType.MULTIPOINT,
+    shapely.GeometryType.MULTILINESTRING: GeometryType.MULTILINESTRING,
+    shapely.GeometryType.MULTIPOLYGON: GeometryType.MULTIPOLYGON,
+}
+
+
+def decode_value(value: Data.Value):
+    kind = value.WhichOneof("value_type")
+    if kind == "neg_int_value":
+        return -value.neg_int_value
+    if kind == "json_value":
+        return json.loads(value.json_value)
+    return getattr(value, kind) if kind else None
+
+
+def decode_properties(keys, values, properties) -> dict:
+    """Properties stored as pairs of indices in the `keys` and `values` tables."""
+    return {
+        keys[key]: decode_value(values[value])
+        for key, value in zip(properties[::2], properties[1::2])
+    }
+
+
+def _structure(geometry: Data.Geometry, dimensions: int):
+    """Number of points of each line or ring and number of rings of each polygon.
+
+    Empty points, multipoints and lines have a single line without points, empty polygons
+    have no rings and empty collections no parts.
+    """
+    n_points = len(geometry.coords) // dimensions
+    lengths = list(geometry.lengths)
+    if geometry.type in (GeometryType.POINT, GeometryType.MULTIPOINT, GeometryType.LINESTRING):
+        return [n_points], []
+    if geometry.type == GeometryType.MULTILINESTRING:
+        return lengths or ([n_points] if n_points else []), []
+    if geometry.type == GeometryType.POLYGON:
+        rings = lengths or ([n_points] if n_points else [])
+        return rings, [len(rings)]
+    if geometry.type == GeometryType.MULTIPOLYGON:
+        if not lengths:
+            return ([n_points], [1]) if n_points else ([], [])
+        rings, polygons = [], []
+        position = 1
+        for _ in range(lengths[0]):
+            n_rings = lengths[position]
+            polygons.append(n_rings)
+            rings.extend(lengths[position + 1 : position + 1 + n_rings])
+            position += n_rings + 1
+        return rings, polygons
+    raise ValueError(f"Unsupported geometry type {geometry.type}")
+
+
+def _decode_points(coords: np.ndarray, ring_lengths: np.ndarray, scale: float) -> np.ndarray:
+    """Delta decode every ring of the concatenated coordinates at once."""
+    if not len(coords):
+        return coords.astype(float)
+    total = np.cumsum(coords, axis=0)
+    starts = np.concatenate([[0], np.cumsum(ring_lengths)[:-1]])
+    # Remove the running sum of the previous rings since each ring restarts from zero
+    offsets = np.where(starts[:, None] > 0, total[np.maximum(starts - 1, 0)], 0)
+    return (total - np.repeat(offsets, ring_lengths, axis=0)) / scale
+
+
+def _collect(constructor, parts, indices, size: int, kind: shapely.GeometryType) -> np.ndarray:
+    """Geometries built from their indexed parts, empty when they have none."""
+    out = shapely.empty(size, geom_type=kind)
+    if len(indices):
+        constructor(parts, indices=indices, out=out)
+    return out
+
+
+def _build(kind, points, ring_lengths, ring_parts, part_rings, part_geometries, n_geometries):
+    """Build geometries of a single type from decoded points and their hierarchy."""
+    ring_ids = np.repeat(np.arange(len(ring_lengths)), ring_lengths)
+    if kind == GeometryType.POINT:
+        geometries = shapely.empty(n_geometries, geom_type=shapely.GeometryType.POINT)
+        geometries[ring_lengths > 0] = shapely.points(points)
+        return geometries
+    if kind == GeometryType.LINESTRING:
+        return _collect(
+            shapely.linestrings,
+            points,
+            ring_ids,
+            n_geometries,
+            shapely.GeometryType.LINESTRING,
+        )
+    if kind == GeometryType.MULTIPOINT:
+        return _collect(
+            shapely.multipoints,
+            shapely.points(points),
+            ring_ids,
+            n_geometries,
+            shapely.GeometryType.MULTIPOINT,
+        )
+    if kind == GeometryType.MULTILINESTRING:
+        lines = shapely.linestrings(points, indices=ring_ids)
+        return _collect(
+            shapely.multilinestrings,
+            lines,
+            ring_parts,
+            n_geometries,
+            shapely.GeometryType.MULTILINESTRING,
+        )
+    rings = shapely.linearrings(points, indices=ring_ids)
+    polygons = _collect(
+        shapely.polygons,
+        rings,
+        np.repeat(np.arange(len(part_rings)), part_rings),
+        len(part_rings),
+        shapely.GeometryType.POLYGON,
+    )
+    if kind == GeometryType.POLYGON:
+        return polygons
+    return _collect(
+        shapely.multipolygons,
+        polygons,
+        part_geometries,
+        n_geometries,
+        shapely.GeometryType.MULTIPOLYGON,
+    )
+
+
+def decode_geometries(geometries: List[Data.Geometry], dimensions: int, precision: int):
+    """Decode a list of geobuf geometries into an array of shapely geometries."""
+    scale = 10.0**precision
+    result = np.empty(len(geometries), dtype=object)
+    kinds = np.array([geometry.type for geometry in geometries], dtype=int)
+    for kind in np.unique(kinds):
+        positions = np.flatnonzero(kinds == kind)
+        if kind == GeometryType.GEOMETRYCOLLECTION:
+            for position in positions:
+                parts = decode_geometries(geometries[position].geometries, dimensions, precision)
+                result[position] = shapely.geometrycollections(list(parts))
+            continue
+        ring_lengths, part_rings, ring_parts, part_geometries = [], [], [], []
+        for index, position in enumerate(positions):
+            rings, parts = _structure(geometries[position], dimensions)
+            ring_lengths.extend(rings)
+            if kind == GeometryType.MULTILINESTRING:
+                ring_parts.extend([index] * len(rings))
+            part_rings.extend(parts)
+            part_geometries.extend([index] * len(parts))
+        coords = np.concatenate(
+            [np.asarray(geometries[position].coords, dtype=np.int64) for position in positions],
+        ).reshape(-1, dimensions)[:, :3]
+        ring_lengths = np.asarray(ring_lengths, dtype=np.int64)
+        points = _decode_points(coords, ring_lengths, scale)
+        result[positions] = _build(
+            kind,
+            points,
+            ring_lengths,
+            np.asarray(ring_parts, dtype=np.int64),
+            np.asarray(part_rings, dtype=np.int64),
+            np.asarray(part_geometries, dtype=np.int64),
+            len(positions),
+        )
+    return result
+
+
+def decode(data: Data) -> Tuple[np.ndarray, List[dict]]:
+    """Decode the geometries and properties of a geobuf message.
+
+    The geometries are returned as an array of shapely geometries with one element per
+    feature, or a single element when `data` holds a geometry.
+    """
+    kind = data.WhichOneof("data_type")
+    if kind == "geometry":
+        return decode_geometries([data.geometry], data.dimensions, data.precision), [{}]
+    features = [data.feature] if kind == "feature" else data.feature_collection.features
+    geometries = decode_geometries(
+        [feature.geometry for feature in features],
+        data.dimensions,
+        data.precision,
+    )
+    properties = []
+    for feature in features:
+        values = decode_properties(data.keys, feature.values, feature.properties)
+        feature_id = feature.WhichOneof("id_type")
+        if feature_id:
+            values["id"] = getattr(feature, feature_id)
+        properties.append(values)
+    return geometries, properties
+
+
+def encode_value(value) -> Data.Value:
+    if isinstance(value, bool):
+        return Data.Value(bool_value=value)
+    if isinstance(value, (int, np.integer)):
+        if value < 0:
+            return Data.Value(neg_int_value=-int(value))
+        return Data.Value(pos_int_value=int(value))
+    if isinstance(value, (float, np.floating)):
+        return Data.Value(double_value=float(value))
+    if isinstance(value, str):
+        return Data.Value(string_value=value)
+    return Data.Value(json_value=json.dumps(value))
+
+
+def _flatten(geometries: np.ndarray, kind: GeometryType, dimensions: int, scale: float):
+    """Delta encoded coordinates and lengths of geometries of a single type."""
+    _, coords, offsets = shapely.to_ragged_array(geometries, include_z=dimensions == 3)
+    n_geometries = len(geometries)
+    if kind == GeometryType.POINT:
+        # Empty points have NaN coordinates, they are stored without any
+        present = ~shapely.is_empty(geometries)
+        coords = coords[present]
+        ring_offsets = np.concatenate([[0], np.cumsum(present)])
+    else:
+        ring_offsets = np.asarray(offsets[0], dtype=np.int64)
+    if kind in (GeometryType.MULTILINESTRING, GeometryType.POLYGON):
+        geometry_rings = np.asarray(offsets[1], dtype=np.int64)
+    elif kind == GeometryType.MULTIPOLYGON:
+        geometry_rings = np.asarray(offsets[1], dtype=np.int64)[offsets[2]]
+    else:
+        geometry_rings = np.arange(n_geometries + 1)
+
+    quantized = np.round(coords * scale).astype(np.int64)
+    deltas = np.diff(quantized, axis=0, prepend=0)
+    ring_starts = ring_offsets[:-1][np.diff(ring_offsets) > 0]
+    # Each ring restarts from zero
+    deltas[ring_starts] = quantized[ring_starts]
+    ring_lengths = np.diff(ring_offsets)
+    if kind in (GeometryType.POLYGON, GeometryType.MULTIPOLYGON):
+        # The closing point of the rings is not stored
+        keep = np.ones(len(deltas), dtype=bool)
+        keep[ring_offsets[1:][ring_lengths > 0] - 1] = False
+        deltas = deltas[keep]
+        ring_lengths = np.maximum(ring_lengths - 1, 0)
+    point_offsets = np.concatenate([[0], np.cumsum(ring_lengths)]) * dimensions
+    flat = deltas.ravel().tolist()
+    ring_lengths = ring_lengths.tolist()
+
+    for index in range(n_geometries):
+        first, last = geometry_rings[index], geometry_rings[index + 1]
+        geometry_coords = flat[point_offsets[first] : point_offsets[last]]
+        lengths = []
+        if kind in (GeometryType.MULTILINESTRING, GeometryType.POLYGON) and last - first != 1:
+            lengths = ring_lengths[first:last]
+        elif kind == GeometryType.MULTIPOLYGON:
+            polygons = offsets[1][offsets[2][index] : offsets[2][index + 1] + 1]
+            if len(polygons) != 2 or polygons[1] - polygons[0] != 1:
+                lengths = [len(polygons) - 1]
+                for start, end in zip(polygons[:-1], polygons[1:]):
+                    lengths.append(end - start)
+                    lengths.extend(ring_lengths[start:end])
+        yield geometry_coords, lengths
+
+
+def encode(
+    geometries: Sequence,
+    properties: Optional[Sequence[dict]] = None,
+    precision: int = 6,
+    dimensions: int = 2,
+) -> Data:
+    """Encode shapely geometries and their properties as a geobuf feature collection.
+
+    `geometries` can be any sequence of shapely geometries, e.g. a NumPy array or the
+    values of a GeoPandas `GeoSeries`.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    data = Data(dimensions=dimensions, precision=precision)
+    features = [data.feature_collection.features.add() for _ in range(len(geometries))]
+    type_ids = shapely.get_type_id(geometries)
+    scale = 10.0**precision
+    for type_id in np.unique(type_ids):
+        positions = np.flatnonzero(type_ids == type_id)
+        if type_id not in SHAPELY_TYPES:
+            raise ValueError(f"Unsupported geometry type {shapely.GeometryType(type_id).name}")
+        kind = SHAPELY_TYPES[type_id]
+        flattened = _flatten(geometries[positions], kind, dimensions, scale)
+        for position, (coords, lengths) in zip(positions, flattened):
+            geometry = features[position].geometry
+            geometry.type = kind
+            geometry.coords.extend(coords)
+            geometry.lengths.extend(lengths)
+    if properties is not None:
+        keys = {}
+        for feature, values in zip(features, properties):
+            for key, value in values.items():
+                feature.properties.extend([keys.setdefault(key, len(keys)), len(feature.values)])
+                feature.values.append(encode_value(value))
+        data.keys.extend(keys)
+    return data
+
+
+def iter_geojson_features(path, chunk_size: int = 2**20) -> Iterator[dict]:
+    """Iterate over the features of a GeoJSON feature collection without loading it whole."""
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"features"\s*:\s*\[')
+    separators = re.compile(r"[\s,]*")
+    with open(path) as file:
+        buffer = ""
+        match = None
+        while match is None:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+            match = start.search(buffer)
+        position = match.end()
+        while True:
+            position = separators.match(buffer, position).end()
+            if buffer.startswith("]", position):
+                return
+            try:
+                feature, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The feature is not fully read yet
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield feature
+            position = end
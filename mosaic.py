@@ -0,0 +1,125 @@
+"""Mosaic of the segmentations of the responses warped once into a single web mercator canvas.
+
+Where footprints overlap, the pixel of the response with the highest priority is kept:
+the latest publication date or the lowest cloud cover depending on the rule.
+"""
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import folium
+import numpy as np
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from shapely import wkt
+
+from snapearth.api.v1.database_pb2 import SegmentationResponse
+from tiles import TILE_COLORMAP, TILE_SIZE, TRANSPARENT_INDEX, WORLD_EXTENT
+from utils import CATEGORY_INDEX, encode_png, open_raster, png_url
+
+MOSAIC_CRS = "EPSG:3857"
+RULES = ("latest", "cloud_cover")
+# Web mercator is not defined at the poles
+MAX_LATITUDE = 85.0511
+
+
+@lru_cache(maxsize=4096)
+def mercator_bounds(bounds: Tuple[float, float, float, float]) -> Tuple[float, ...]:
+    xmin, ymin, xmax, ymax = bounds
+    ymin, ymax = max(ymin, -MAX_LATITUDE), min(ymax, MAX_LATITUDE)
+    return transform_bounds("EPSG:4326", MOSAIC_CRS, xmin, ymin, xmax, ymax)
+
+
+def warp_segmentation(segmentation, transform: Affine, width: int, height: int):
+    """Palette indices of a segmentation warped to a window of the canvas and its coverage."""
+    with open_raster(segmentation) as dataset:
+        with WarpedVRT(
+            dataset,
+            crs=MOSAIC_CRS,
+            transform=transform,
+            width=width,
+            height=height,
+            resampling=Resampling.nearest,
+            add_alpha=True,
+        ) as vrt:
+            array, alpha = vrt.read()
+    return CATEGORY_INDEX[array], alpha > 0
+
+
+class Mosaic:
+    """EPSG:3857 canvas covering `bounds` at the resolution of the web mercator `zoom` level."""
+
+    def __init__(self, bounds: Tuple[float, float, float, float], zoom: int, rule: str = "latest"):
+        if rule not in RULES:
+            raise ValueError(f"Unknown rule {rule!r}, expected one of {RULES}")
+        self.rule = rule
+        resolution = 2 * WORLD_EXTENT / (TILE_SIZE * 2**zoom)
+        xmin, ymin, xmax, ymax = mercator_bounds(tuple(bounds))
+        self.width = max(1, int(np.ceil((xmax - xmin) / resolution)))
+        self.height = max(1, int(np.ceil((ymax - ymin) / resolution)))
+        self.transform = Affine(resolution, 0.0, xmin, 0.0, -resolution, ymax)
+        self.indices = np.full((self.height, self.width), TRANSPARENT_INDEX, dtype=np.ubyte)
+        self.priority = np.full((self.height, self.width), -np.inf)
+
+    def _priority(self, response: SegmentationResponse) -> float:
+        if self.rule == "latest":
+            return response.publication_date.ToNanoseconds()
+        return -response.cloud_cover
+
+    def window(self, bounds: Tuple[float, float, float, float]) -> Optional[Window]:
+        """Window of the canvas covered by longitude and latitude bounds, None if outside."""
+        xmin, ymin, xmax, ymax = mercator_bounds(tuple(bounds))
+        inverse = ~self.transform
+        col_start, row_start = inverse * (xmin, ymax)
+        col_stop, row_stop = inverse * (xmax, ymin)
+        col_start, row_start = max(int(np.floor(col_start)), 0), max(int(np.floor(row_start)), 0)
+        col_stop = min(int(np.ceil(col_stop)), self.width)
+        row_stop = min(int(np.ceil(row_stop)), self.height)
+        if col_start >= col_stop or row_start >= row_stop:
+            return None
+        return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+    def decode(self, response: SegmentationResponse) -> Optional[tuple]:
+        """`warp_segmentation` and its arguments for a response, None if outside the canvas."""
+        window = self.window(wkt.loads(response.wkt).bounds)
+        if window is None:
+            return None
+        transform = window_transform(window, self.transform)
+        return warp_segmentation, response.segmentation, transform, window.width, window.height
+
+    def add(self, response: SegmentationResponse, warped=None):
+        """Write a response to the canvas, `warped` is the result of `warp_segmentation`."""
+        window = self.window(wkt.loads(response.wkt).bounds)
+        if window is None:
+            return
+        if warped is None:
+            function, *args = self.decode(response)
+            warped = function(*args)
+        indices, covered = warped
+        rows, cols = window.toslices()
+        priority = self.priority[rows, cols]
+        update = covered & (self._priority(response) > priority)
+        # Slices are views, the canvas is updated in place
+        self.indices[rows, cols][update] = indices[update]
+        priority[update] = self._priority(response)
+
+    @property
+    def latlon_bounds(self) -> Tuple[Tuple[float, float], Tuple[float, float]]:
+        xmin, ymax = self.transform * (0, 0)
+        xmax, ymin = self.transform * (self.width, self.height)
+        west, south, east, north = transform_bounds(MOSAIC_CRS, "EPSG:4326", xmin, ymin, xmax, ymax)
+        return (south, west), (north, east)
+
+    def to_png(self) -> bytes:
+        return encode_png(self.indices, colormap=TILE_COLORMAP)
+
+    def add_to(self, map_, **kwargs):
+        """Add the mosaic to a map as a single image overlay."""
+        folium.raster_layers.ImageOverlay(
+            png_url(self.to_png()),
+            bounds=self.latlon_bounds,
+            **kwargs,
+        ).add_to(map_)
@@ -0,0 +1,279 @@
+"""Local stand-in for the EarthSignature service serving synthetic products.
+
+The server is configured through environment variables, e.g.:
+
+    SNAPEARTH_SERVER_PORT=50051 SNAPEARTH_SERVER_SIZE=1024 python server.py
+"""
+import asyncio
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional
+
+import environ
+import numpy as np
+import shapely
+from grpclib.const import Status
+from grpclib.exceptions import GRPCError
+from grpclib.server import Server
+from grpclib.utils import graceful_exit
+from rasterio.enums import Resampling
+from rasterio.features import shapes
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+from shapely import wkt
+from shapely.geometry import shape
+
+from geobuf import encode
+from geobufproto.geobuf_pb2 import Data
+from snapearth.api.v1 import database_grpc as database_grpc_v1
+from snapearth.api.v1 import database_pb2 as database_pb2_v1
+from snapearth.api.v2 import database_grpc as database_grpc_v2
+from snapearth.api.v2 import database_pb2 as database_pb2_v2
+from utils import CATEGORY_TO_RGB, EUROPE_COORDINATES
+
+# Resolution of the land cover patterns, rasters are upsampled from this grid
+COARSE_SIZE = 128
+GEOBUF_PRECISION = 6
+
+
+@environ.config(prefix="SNAPEARTH_SERVER")
+class ServerConfig:
+    host: str = environ.var(default="127.0.0.1")
+    port: int = environ.var(default=50051, converter=int)
+    # Number of products in the synthetic catalog
+    products: int = environ.var(default=1000, converter=int)
+    # Width and height of the segmentation rasters
+    size: int = environ.var(default=512, converter=int)
+    seed: int = environ.var(default=0, converter=int)
+    start_date: str = environ.var(default="2021-01-01")
+    end_date: str = environ.var(default="2022-01-01")
+    # Delay in seconds before answering a request
+    latency: float = environ.var(default=0.0, converter=float)
+    # Throughput limit in bytes per second, 0 to disable it
+    bandwidth: float = environ.var(default=0.0, converter=float)
+    # Build internal overviews in the GeoTIFFs
+    overviews: bool = environ.bool_var(default=True)
+
+
+def to_geotiff(array, bounds, overviews: bool = True) -> bytes:
+    """Deflate compressed GeoTIFF, with internal overviews down to 64 pixels if `overviews`."""
+    height, width = array.shape
+    with MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff",
+            width=width,
+            height=height,
+            count=1,
+            dtype=array.dtype,
+            crs="EPSG:4326",
+            transform=from_bounds(*bounds, width, height),
+            compress="deflate",
+        ) as dataset:
+            dataset.write(array, 1)
+            if overviews:
+                factors = [2**i for i in range(1, int(np.log2(min(height, width) / 64)) + 1)]
+                dataset.build_overviews(factors, Resampling.nearest)
+        return memfile.read()
+
+
+def encode_categories(labels, bounds) -> Data:
+    """Geobuf feature collection of the polygons covered by each category."""
+    transform = from_bounds(*bounds, labels.shape[1], labels.shape[0])
+    geometries, categories = zip(*shapes(labels, transform=transform))
+    return encode(
+        [shape(geometry) for geometry in geometries],
+        [{"category": int(category)} for category in categories],
+        precision=GEOBUF_PRECISION,
+    )
+
+
+class SyntheticCatalog:
+    """Deterministic catalog of products with random footprints, dates and land cover."""
+
+    def __init__(self, cfg: ServerConfig):
+        self.cfg = cfg
+        rng = np.random.default_rng(cfg.seed)
+        start = np.datetime64(cfg.start_date, "s")
+        end = np.datetime64(cfg.end_date, "s")
+        self.dates = np.sort(start + rng.integers(0, (end - start).astype(int), cfg.products))
+        xmin, ymin, xmax, ymax = EUROPE_COORDINATES.bounds
+        widths = rng.uniform(0.5, 2.0, cfg.products)
+        xs = rng.uniform(xmin, xmax - widths)
+        ys = rng.uniform(ymin, ymax - widths)
+        self.footprints = shapely.box(xs, ys, xs + widths, ys + widths)
+        self.cloud_covers = rng.beta(0.7, 2.0, cfg.products).astype(np.float32)
+        self.product_types = rng.choice(["S2MSI1C", "S2MSI2A"], cfg.products)
+        self.product_ids = np.array([f"SYNTHETIC_{i:08d}" for i in range(cfg.products)])
+
+    def query(self, request) -> np.ndarray:
+        """Indices of the products matching a `ListSegmentationRequest`, newest first."""
+        mask = np.ones(len(self.dates), dtype=bool)
+        if request.HasField("start_date"):
+            mask &= self.dates >= np.datetime64(request.start_date.ToDatetime(), "s")
+        if request.HasField("end_date"):
+            mask &= self.dates <= np.datetime64(request.end_date.ToDatetime(), "s")
+        if request.wkt:
+            mask &= shapely.intersects(self.footprints, wkt.loads(request.wkt))
+        if request.product_ids:
+            mask &= np.isin(self.product_ids, request.product_ids)
+        indices = np.flatnonzero(mask)[::-1]
+        return indices[: request.n_results] if request.n_results else indices
+
+    def _rng(self, index: int):
+        return np.random.default_rng((self.cfg.seed, index))
+
+    @lru_cache(maxsize=64)
+    def labels(self, index: int) -> np.ndarray:
+        """Coarse land cover map made of Voronoi cells of random CORINE categories."""
+        rng = self._rng(index)
+        codes = np.fromiter(CATEGORY_TO_RGB, dtype=np.uint16)
+        seeds = rng.uniform(0, COARSE_SIZE, (32, 2))
+        grid = np.indices((COARSE_SIZE, COARSE_SIZE)).reshape(2, -1).T
+        nearest = ((grid[:, None, :] - seeds[None]) ** 2).sum(axis=-1).argmin(axis=1)
+        return rng.choice(codes, len(seeds))[nearest].reshape(COARSE_SIZE, COARSE_SIZE)
+
+    def _upsample(self, array: np.ndarray) -> np.ndarray:
+        factor = -(-self.cfg.size // array.shape[0])
+        return np.repeat(np.repeat(array, factor, axis=0), factor, axis=1)[
+            : self.cfg.size,
+            : self.cfg.size,
+        ]
+
+    @lru_cache(maxsize=64)
+    def segmentation(self, index: int) -> bytes:
+        return to_geotiff(
+            self._upsample(self.labels(index)),
+            self.footprints[index].bounds,
+            overviews=self.cfg.overviews,
+        )
+
+    @lru_cache(maxsize=64)
+    def cloud_mask(self, index: int) -> bytes:
+        noise = self._rng(index).random((16, 16))
+        threshold = np.quantile(noise, 1 - self.cloud_covers[index])
+        mask = self._upsample((noise > threshold).astype(np.uint8))
+        return to_geotiff(mask, self.footprints[index].bounds, overviews=self.cfg.overviews)
+
+    def _fill(self, response, index: int):
+        response.wkt = self.footprints[index].wkt
+        response.product_id = self.product_ids[index]
+        response.product_type = self.product_types[index]
+        response.cloud_cover = self.cloud_covers[index]
+        date = self.dates[index].astype(datetime)
+        response.publication_date.FromDatetime(date)
+        response.creation_date.FromDatetime(date)
+        response.quicklook = f"https://example.com/{response.product_id}/quicklook.png"
+        response.browse_url = f"https://example.com/{response.product_id}"
+        response.download_url = f"https://example.com/{response.product_id}/download"
+        return response
+
+    def response_v1(self, index: int) -> database_pb2_v1.SegmentationResponse:
+        response = self._fill(database_pb2_v1.SegmentationResponse(), index)
+        response.segmentation = self.segmentation(index)
+        response.cloud_mask = self.cloud_mask(index)
+        return response
+
+    def response_v2(self, index: int) -> database_pb2_v2.SegmentationResponse:
+        response = self._fill(database_pb2_v2.SegmentationResponse(), index)
+        labels = self.labels(index)
+        response.categories.CopyFrom(encode_categories(labels, self.footprints[index].bounds))
+        return response
+
+
+class _SyntheticService:
+    def __init__(self, catalog: SyntheticCatalog):
+        self.catalog = catalog
+        self.created = 0
+
+    async def _send(self, stream, responses):
+        cfg = self.catalog.cfg
+        if cfg.latency:
+            await asyncio.sleep(cfg.latency)
+        for response in responses:
+            if cfg.bandwidth:
+                await asyncio.sleep(response.ByteSize() / cfg.bandwidth)
+            await stream.send_message(response)
+
+    async def CreateProduct(self, stream):
+        await stream.recv_message()
+        self.created += 1
+        await stream.send_message(self.create_response_type())
+
+    async def SearchSegmentation(self, stream):
+        raise GRPCError(Status.UNIMPLEMENTED)
+
+
+class SyntheticServiceV1(_SyntheticService, database_grpc_v1.DatabaseProductServiceBase):
+    create_response_type = database_pb2_v1.CreateProductResponse
+
+    async def ListSegmentation(self, stream):
+        request = await stream.recv_message()
+        indices = self.catalog.query(request)
+        await self._send(stream, (self.catalog.response_v1(i) for i in indices))
+
+
+class SyntheticServiceV2(_SyntheticService, database_grpc_v2.DatabaseProductServiceBase):
+    create_response_type = database_pb2_v2.CreateProductResponse
+
+    async def ListSegmentation(self, stream):
+        request = await stream.recv_message()
+        indices = self.catalog.query(request)
+        await self._send(stream, (self.catalog.response_v2(i) for i in indices))
+
+
+def build_services(cfg: ServerConfig) -> List[_SyntheticService]:
+    catalog = SyntheticCatalog(cfg)
+    return [SyntheticServiceV1(catalog), SyntheticServiceV2(catalog)]
+
+
+def build_server(cfg: ServerConfig, services: Optional[List[_SyntheticService]] = None) -> Server:
+    return Server(services if services is not None else build_services(cfg))
+
+
+@contextmanager
+def serve_in_thread(cfg: ServerConfig, services: Optional[List[_SyntheticService]] = None):
+    """Run a server in a background thread, yield the port it listens on.
+
+    Pass the `services` built by `build_services` to inspect them while the server runs.
+    """
+    started = threading.Event()
+    state = {}
+
+    async def serve():
+        server = build_server(cfg, services)
+        try:
+            await server.start(cfg.host, cfg.port)
+            state.update(
+                loop=asyncio.get_running_loop(),
+                server=server,
+                port=server._server.sockets[0].getsockname()[1],
+            )
+        finally:
+            started.set()
+        await server.wait_closed()
+
+    thread = threading.Thread(target=asyncio.run, args=(serve(),), daemon=True)
+    thread.start()
+    started.wait()
+    if "port" not in state:
+        thread.join()
+        raise RuntimeError(f"Could not start the server on {cfg.host}:{cfg.port}")
+    try:
+        yield state["port"]
+    finally:
+        state["loop"].call_soon_threadsafe(state["server"].close)
+        thread.join()
+
+
+async def main(cfg: ServerConfig):
+    server = build_server(cfg)
+    with graceful_exit([server]):
+        await server.start(cfg.host, cfg.port)
+        print(f"Serving {cfg.products} synthetic products on {cfg.host}:{cfg.port}")
+        await server.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(ServerConfig.from_environ()))
@@ -0,0 +1,99 @@
+"""Land cover area of each CORINE category in the segmentations of the responses."""
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask
+from shapely.geometry.base import BaseGeometry
+
+from snapearth.api.v1.database_pb2 import SegmentationResponse
+from utils import open_raster, read_inmemory
+
+# Authalic radius of the earth in km, the sphere having the area of the WGS84 ellipsoid
+EARTH_RADIUS = 6371.0072
+
+
+def pixel_areas(dataset) -> np.ndarray:
+    """Area in km² of the pixels of each row of a north up raster."""
+    transform = dataset.transform
+    if not dataset.crs.is_geographic:
+        area = abs(transform.a * transform.e) / 1e6 * dataset.crs.linear_units_factor[1] ** 2
+        return np.full(dataset.height, area)
+    # Area between two parallels is proportional to the difference of the sines of their latitudes
+    latitudes = np.radians(transform.f + transform.e * np.arange(dataset.height + 1))
+    return EARTH_RADIUS**2 * np.radians(abs(transform.a)) * np.abs(np.diff(np.sin(latitudes)))
+
+
+def category_areas(
+    segmentation,
+    cloud_mask=b"",
+    aoi: Optional[BaseGeometry] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Categories found in a segmentation with their number of pixels and area in km².
+
+    Pixels which are cloudy according to `cloud_mask` or outside of `aoi` are ignored.
+    """
+    with open_raster(segmentation) as dataset:
+        array = dataset.read(1)
+        row_areas = pixel_areas(dataset)
+        valid = np.ones(array.shape, dtype=bool)
+        if aoi is not None:
+            valid &= geometry_mask([aoi], array.shape, dataset.transform, invert=True)
+    if cloud_mask:
+        cloudy = read_inmemory(
+            cloud_mask,
+            height=array.shape[0],
+            width=array.shape[1],
+            resampling=Resampling.nearest,
+            dtype=rasterio.ubyte,
+        )[0]
+        valid &= cloudy == 0
+    categories = array[valid]
+    areas = np.broadcast_to(row_areas[:, None], array.shape)[valid]
+    counts = np.bincount(categories, minlength=1)
+    area_sums = np.bincount(categories, weights=areas, minlength=1)
+    found = np.flatnonzero(counts)
+    return found, counts[found], area_sums[found]
+
+
+def category_statistics(
+    responses: Iterable[SegmentationResponse],
+    aoi: Optional[BaseGeometry] = None,
+    mask_clouds: bool = True,
+    executor: Optional[Executor] = None,
+) -> pd.DataFrame:
+    """Pixel count and area in km² of each category of each response.
+
+    The segmentations are processed in parallel in `executor`, a thread pool by default.
+    The table has a row per response and category, indexed by product id and publication
+    date, and can be converted to Arrow with `pyarrow.Table.from_pandas`.
+    """
+    responses = list(responses)
+    areas = partial(category_areas, aoi=aoi)
+    args = (
+        [response.segmentation for response in responses],
+        [response.cloud_mask if mask_clouds else b"" for response in responses],
+    )
+    if executor is None:
+        with ThreadPoolExecutor() as pool:
+            results = list(pool.map(areas, *args))
+    else:
+        results = list(executor.map(areas, *args))
+    lengths = [len(categories) for categories, _, _ in results]
+    table = pd.DataFrame(
+        {
+            "product_id": np.repeat([response.product_id for response in responses], lengths),
+            "publication_date": np.repeat(
+                [response.publication_date.ToDatetime() for response in responses],
+                lengths,
+            ),
+            "category": np.concatenate([r[0] for r in results] or [[]]).astype(np.uint16),
+            "pixels": np.concatenate([r[1] for r in results] or [[]]).astype(np.int64),
+            "area_km2": np.concatenate([r[2] for r in results] or [[]]).astype(float),
+        },
+    )
+    return table.set_index(["product_id", "publication_date"])
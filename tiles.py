@@ -0,0 +1,215 @@
+"""XYZ tile server rendering the segmentations of the responses on demand.
+
+Instead of inlining every raster in the map, `plot_responses` adds a `folium.TileLayer`
+pointing at this server and the browser only loads the tiles it displays.
+"""
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from shapely import wkt
+
+from snapearth.api.v1.database_pb2 import SegmentationResponse
+from utils import CATEGORY_INDEX, PNG_COLORMAP, encode_png, open_raster
+
+TILE_SIZE = 256
+# Half of the width of the web mercator world in meters
+WORLD_EXTENT = 20037508.342789244
+TRANSPARENT_INDEX = len(PNG_COLORMAP)
+TILE_COLORMAP = {
+    **{index: (*rgb, 255) for index, rgb in PNG_COLORMAP.items()},
+    TRANSPARENT_INDEX: (0, 0, 0, 0),
+}
+TILE_PATH = re.compile(r"^/(?P<layer>[0-9a-f]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$")
+
+
+def tile_transform(z: int, x: int, y: int) -> Affine:
+    """Transform of a tile in EPSG:3857."""
+    size = 2 * WORLD_EXTENT / 2**z
+    return Affine(
+        size / TILE_SIZE,
+        0.0,
+        -WORLD_EXTENT + x * size,
+        0.0,
+        -size / TILE_SIZE,
+        WORLD_EXTENT - y * size,
+    )
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Longitude and latitude bounds of a tile."""
+    n = 2**z
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.array([y + 1, y]) / n))))
+    return x / n * 360 - 180, lats[0], (x + 1) / n * 360 - 180, lats[1]
+
+
+def render_tile(responses: List[SegmentationResponse], z: int, x: int, y: int) -> bytes:
+    """Paletted PNG of a tile, the last responses are drawn over the first ones."""
+    tile = np.full((TILE_SIZE, TILE_SIZE), TRANSPARENT_INDEX, dtype=np.ubyte)
+    for response in responses:
+        with open_raster(response.segmentation) as dataset:
+            with WarpedVRT(
+                dataset,
+                crs="EPSG:3857",
+                transform=tile_transform(z, x, y),
+                width=TILE_SIZE,
+                height=TILE_SIZE,
+                resampling=Resampling.nearest,
+                add_alpha=True,
+            ) as vrt:
+                # The closest overview is used when the tile is zoomed out
+                array, alpha = vrt.read()
+        covered = alpha > 0
+        tile[covered] = CATEGORY_INDEX[array[covered]]
+    return encode_png(tile, colormap=TILE_COLORMAP)
+
+
+class TileLayer:
+    """Responses drawn on the same tiles, they can be added while the tiles are served."""
+
+    def __init__(self, server: "TileServer"):
+        self.id = uuid.uuid4().hex
+        self.server = server
+        self.responses: List[SegmentationResponse] = []
+        self._bounds = np.empty((0, 4))
+
+    @property
+    def url(self) -> str:
+        return f"{self.server.url}/{self.id}/{{z}}/{{x}}/{{y}}.png"
+
+    def add(self, response: SegmentationResponse):
+        bounds = np.array([wkt.loads(response.wkt).bounds])
+        self._bounds = np.concatenate([self._bounds, bounds])
+        self.responses.append(response)
+
+    def tile(self, z: int, x: int, y: int) -> Tuple[int, List[SegmentationResponse]]:
+        """Number of responses of the layer and those overlapping a tile."""
+        n_responses = len(self.responses)
+        xmin, ymin, xmax, ymax = tile_bounds(z, x, y)
+        bounds = self._bounds[:n_responses]
+        overlaps = (
+            (bounds[:, 0] < xmax)
+            & (bounds[:, 2] > xmin)
+            & (bounds[:, 1] < ymax)
+            & (bounds[:, 3] > ymin)
+        )
+        return n_responses, [self.responses[i] for i in np.flatnonzero(overlaps)]
+
+
+class TileServer:
+    """HTTP server rendering `{z}/{x}/{y}.png` tiles in a background thread.
+
+    Rendered tiles are kept in an LRU cache of `max_tiles` tiles. Layers hold their
+    responses, only the last `max_layers` layers added are kept and served.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_tiles: int = 1024,
+        max_layers: int = 4,
+    ):
+        self.max_tiles = max_tiles
+        self.max_layers = max_layers
+        self.layers: Dict[str, TileLayer] = {}
+        self._tiles: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, cfg) -> Optional["TileServer"]:
+        """Build a server from a `DemoConfig.Tiles` configuration, None if it is disabled."""
+        if not cfg.enabled:
+            return None
+        return cls(cfg.host, cfg.port, cfg.max_tiles, cfg.max_layers)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_layer(self) -> TileLayer:
+        """Add a new layer, removing the oldest ones beyond `max_layers`."""
+        layer = TileLayer(self)
+        self.layers[layer.id] = layer
+        while len(self.layers) > self.max_layers:
+            self.remove_layer(next(iter(self.layers)))
+        return layer
+
+    def remove_layer(self, layer_id: str):
+        """Stop serving a layer and release its responses and tiles."""
+        self.layers.pop(layer_id, None)
+        with self._lock:
+            for key in [key for key in self._tiles if key[0] == layer_id]:
+                del self._tiles[key]
+
+    def tile(self, layer_id: str, z: int, x: int, y: int) -> Optional[bytes]:
+        """PNG of a tile, None when the layer is unknown or was removed."""
+        layer = self.layers.get(layer_id)
+        if layer is None:
+            return None
+        n_responses, responses = layer.tile(z, x, y)
+        # Responses added to the layer since a tile was rendered invalidate it
+        key = (layer_id, n_responses, z, x, y)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+        png = render_tile(responses, z, x, y)
+        with self._lock:
+            self._tiles[key] = png
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return png
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = TILE_PATH.match(self.path)
+                if match is None:
+                    self.send_error(404)
+                    return
+                png = server.tile(
+                    match["layer"],
+                    int(match["z"]),
+                    int(match["x"]),
+                    int(match["y"]),
+                )
+                if png is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(png)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(png)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "TileServer":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
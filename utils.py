@@ -1,24 +1,31 @@
 import asyncio
+import base64
+import html
+import json
+import threading
 import warnings
 from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import date, datetime
-from typing import Iterable, List
+from typing import AsyncIterator, Callable, Iterable, List, NamedTuple, Optional, Tuple
 
 import environ
 import folium
 import numpy as np
-import pandas as pd
 import rasterio
-from google.protobuf import timestamp_pb2
-from grpclib.client import Channel
-from grpclib.config import Configuration
+import shapely
+from folium.plugins import MarkerCluster
 from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
 from rasterio.io import MemoryFile
 from shapely import wkt
 from shapely.geometry import mapping
 from tqdm import tqdm
 
-from snapearth.api.v1.database_grpc import DatabaseProductServiceStub
+from cache import ResponseCache, blob_path, is_blob_ref
+from catalog import Catalog
+from client import EarthSignatureClient, get_client
 from snapearth.api.v1.database_pb2 import ListSegmentationRequest, SegmentationResponse
 
 # Europe bounding box
@@ -76,6 +83,7 @@ CATEGORY_TO_RGB = OrderedDict(
         523: (230, 242, 255),
     },
 )
+UNKNOWN_CATEGORY_RGB = (255, 255, 255)
 
 
 @environ.config(prefix="SNAPEARTH")
@@ -86,11 +94,83 @@ class DemoConfig:
         port: int = environ.var(converter=int)
         max_receive_message_length: int = environ.var(converter=int)
         max_send_message_length: int = environ.var(converter=int)
+        keepalive_time_ms: int = environ.var(default=30000, converter=int)
         keepalive_timeout_ms: int = environ.var(converter=int)
         use_ssl: bool = environ.bool_var()
         max_results: int = environ.var(default=1, converter=int)
+        max_concurrent_streams: int = environ.var(default=4, converter=int)
+
+    @environ.config
+    class Cache:
+        # Responses are not cached when no directory is set
+        directory: str = environ.var(default="")
+        max_bytes: int = environ.var(default=2**30, converter=int)
+        ttl: float = environ.var(default=24 * 3600, converter=float)
+        stale_ttl: float = environ.var(default=7 * 24 * 3600, converter=float)
+
+    @environ.config
+    class Catalog:
+        # Responses are not kept in a local catalog when no directory is set
+        directory: str = environ.var(default="")
+        max_bytes: int = environ.var(default=2**30, converter=int)
+        # Covered date ranges are fetched again after `ttl` seconds
+        ttl: float = environ.var(default=24 * 3600, converter=float)
+
+    @environ.config
+    class Decode:
+        # "thread" or "process", GDAL releases the GIL so threads already run in parallel
+        executor: str = environ.var(default="thread")
+        # Number of workers, 0 for one per CPU
+        workers: int = environ.var(default=0, converter=int)
+
+    @environ.config
+    class Tiles:
+        # Serve the segmentations as tiles instead of inlining them in the map, the
+        # browser must be able to reach the server
+        enabled: bool = environ.bool_var(default=False)
+        host: str = environ.var(default="127.0.0.1")
+        port: int = environ.var(default=0, converter=int)
+        max_tiles: int = environ.var(default=1024, converter=int)
+        # Layers of the previous maps are dropped with their responses
+        max_layers: int = environ.var(default=4, converter=int)
 
     grpc: GRPC = environ.group(GRPC)
+    cache: Cache = environ.group(Cache)
+    catalog: Catalog = environ.group(Catalog)
+    decode: Decode = environ.group(Decode)
+    tiles: Tiles = environ.group(Tiles)
+
+
+def build_executor(cfg) -> Executor:
+    """Build the pool decoding the rasters from a `DemoConfig.Decode` configuration."""
+    workers = cfg.workers or None
+    if cfg.executor == "thread":
+        return ThreadPoolExecutor(workers)
+    if cfg.executor == "process":
+        return ProcessPoolExecutor(workers)
+    raise ValueError(f"Unknown executor {cfg.executor!r}, expected 'thread' or 'process'")
+
+
+def build_request(
+    geom: str,
+    start_date: date,
+    end_date: date,
+    product_ids: List[str],
+    categories: List[str],
+    n_results: int,
+) -> ListSegmentationRequest:
+    geom = geom if not geom == "" else geom
+    request = ListSegmentationRequest(
+        wkt=geom,
+        product_ids=product_ids,
+        categories=categories,
+        n_results=n_results,
+    )
+    # Timestamp.FromDatetime fills the message in place and returns None
+    request.start_date.FromDatetime(datetime.combine(start_date, datetime.min.time()))
+    # The end date is included, up to its last microsecond
+    request.end_date.FromDatetime(datetime.combine(end_date, datetime.max.time()))
+    return request
 
 
 async def request_earthsignature(
@@ -103,70 +183,421 @@ async def request_earthsignature(
     product_ids: List[str],
     categories: List[str],
     n_results: int,
+    cache: Optional[ResponseCache] = None,
+    client: Optional[EarthSignatureClient] = None,
 ) -> Iterable[SegmentationResponse]:
-    min_time = datetime.min.time()
-    config = Configuration(
-        http2_connection_window_size=2000000000,
-        http2_stream_window_size=2000000000,
-    )
-    async with Channel(
-        host=host,
-        port=port,
-        ssl=use_ssl,
-        config=config,
-    ) as channel:
-        stub = DatabaseProductServiceStub(channel)
-        geom = geom if not geom == "" else geom
-        request = ListSegmentationRequest(
-            wkt=geom,
-            start_date=timestamp_pb2.Timestamp().FromDatetime(
-                datetime.combine(start_date, min_time),
-            ),
-            end_date=timestamp_pb2.Timestamp().FromDatetime(
-                datetime.combine(end_date, min_time),
-            ),
-            product_ids=product_ids,
-            categories=categories,
-            n_results=n_results,
+    """Responses of a request, sent with `client` or the client shared by the endpoint."""
+    request = build_request(geom, start_date, end_date, product_ids, categories, n_results)
+    if client is None:
+        client = get_client(host, port, use_ssl)
+    if cache is None:
+        return await client.list_segmentation(request)
+    return [
+        response
+        async for response in cache.stream(request, lambda: client.stream_segmentation(request))
+    ]
+
+
+async def stream_earthsignature(
+    host: str,
+    port: int,
+    use_ssl: bool,
+    geom: str,
+    start_date: date,
+    end_date: date,
+    product_ids: List[str],
+    categories: List[str],
+    n_results: int,
+    grid: Optional[Tuple[int, int]] = None,
+    windows: Optional[int] = None,
+    cache: Optional[ResponseCache] = None,
+    predicate: Optional[Callable[[SegmentationResponse], bool]] = None,
+    catalog: Optional[Catalog] = None,
+    client: Optional[EarthSignatureClient] = None,
+) -> AsyncIterator[SegmentationResponse]:
+    """Same as `request_earthsignature` but yield each response as soon as it is received.
+
+    When a `(rows, cols)` grid is given, the area of interest is split into tiles which
+    are queried concurrently. When a number of `windows` is given, the date range is split
+    instead and the complete list of products is returned ordered by publication date.
+    Responses rejected by `predicate`, such as a `views.ResponseFilter`, are dropped as
+    soon as they are received, the cache still holds them. Stale cache entries are refreshed
+    in the background by the cache.
+    With a `catalog`, the request is answered from the local catalog and only the date
+    ranges it does not cover are fetched, the responses are yielded newest first. It cannot
+    be combined with a `grid` or `windows`.
+    """
+    if grid is not None and windows is not None:
+        raise ValueError("Spatial and temporal sharding cannot be combined")
+    if catalog is not None and (grid is not None or windows is not None):
+        # The catalog covers a date range with the newest n_results products of the request,
+        # tiles cap each of them and windows return them ordered by date instead
+        raise ValueError("Sharding cannot be combined with a catalog")
+    request = build_request(geom, start_date, end_date, product_ids, categories, n_results)
+    if client is None:
+        client = get_client(host, port, use_ssl)
+
+    def fetch(request=request):
+        if grid is not None:
+            return client.stream_tiled_segmentation(request, *grid)
+        if windows is not None:
+            return client.stream_sharded_segmentation(request, windows)
+        return client.stream_segmentation(request)
+
+    def fetch_cached(request=request):
+        if cache is None:
+            return fetch(request)
+        return cache.stream(
+            request,
+            lambda: fetch(request),
+            namespace=f"grid={grid},windows={windows}",
         )
-        return await stub.ListSegmentation(request)
 
+    if catalog is None:
+        responses = fetch_cached()
+    else:
+        responses = catalog.stream(request, fetch_cached)
+    async for response in responses:
+        if predicate is None or predicate(response):
+            yield response
+
+
+@contextmanager
+def open_raster(data):
+    """Open a raster without copying it.
+
+    Blobs of the cache are read from their file and GDAL reads `bytes` in place, other
+    buffers such as a `memoryview` are copied once.
+    """
+    if is_blob_ref(data):
+        with rasterio.open(blob_path(data)) as dataset:
+            yield dataset
+        return
+    with MemoryFile(data if isinstance(data, bytes) else bytes(data)) as memfile:
+        with memfile.open(mode="r") as dataset:
+            yield dataset
+
+
+class BufferPool:
+    """Arrays reused across decodes instead of allocating a new one for each raster.
+
+    At most `max_free` released arrays of each shape and dtype are kept, and at most
+    `max_bytes` in total: the arrays of the least recently used shapes are dropped first.
+    """
+
+    def __init__(self, max_free: int = 4, max_bytes: int = 32 * 2**20):
+        self.max_free = max_free
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        # Released arrays of each shape and dtype, least recently used first
+        self._free = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype) -> np.ndarray:
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            arrays = self._free.get(key)
+            if arrays:
+                array = arrays.pop()
+                self.nbytes -= array.nbytes
+                if not arrays:
+                    del self._free[key]
+                return array
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, array: np.ndarray):
+        if array.nbytes > self.max_bytes:
+            return
+        key = (array.shape, array.dtype)
+        with self._lock:
+            arrays = self._free.setdefault(key, [])
+            self._free.move_to_end(key)
+            if len(arrays) >= self.max_free:
+                return
+            arrays.append(array)
+            self.nbytes += array.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._free.popitem(last=False)
+                self.nbytes -= sum(evicted_array.nbytes for evicted_array in evicted)
+
+
+# Pool of the decode workers, each process has its own
+BUFFERS = BufferPool()
+
+
+def read_inmemory(
+    segmentation,
+    width=None,
+    height=None,
+    resampling=None,
+    dtype=None,
+    max_shape=None,
+    out=None,
+    pool=None,
+):
+    """Read a raster at `width` x `height`, or downsampled to fit in `max_shape` if given.
+
+    Downsampled reads go through `out_shape`, GDAL reads the closest internal overview
+    of the GeoTIFF when there is one instead of the full resolution raster.
+    The raster is read into `out` when given, which sets the shape and the dtype, or into
+    an array taken from `pool`, to be released to it by the caller.
+    """
+    with open_raster(segmentation) as dataset:
+        if out is None:
+            height = height or dataset.height
+            width = width or dataset.width
+            if max_shape is not None:
+                height = min(height, max_shape[0])
+                width = min(width, max_shape[1])
+            shape = (dataset.count, height, width)
+            dtype = dtype or dataset.dtypes[0]
+            out = pool.acquire(shape, dtype) if pool is not None else np.empty(shape, dtype)
+        return dataset.read(out=out, resampling=resampling or Resampling.nearest)
+
+
+def display_shape(bounds, zoom) -> Tuple[int, int]:
+    """Height and width in pixels of `bounds` shown on a web mercator map at `zoom`."""
+    xmin, ymin, xmax, ymax = bounds
+    # Size of the world in pixels, made of 256 x 256 tiles
+    world = 256 * 2**zoom
+    mercator = np.log(np.tan(np.pi / 4 + np.radians([ymin, ymax]) / 2)) / (2 * np.pi)
+    height = (mercator[1] - mercator[0]) * world
+    width = (xmax - xmin) / 360 * world
+    return max(1, int(np.ceil(height))), max(1, int(np.ceil(width)))
+
+
+def build_palette(category_to_rgb=CATEGORY_TO_RGB, fallback=UNKNOWN_CATEGORY_RGB):
+    """Lookup table mapping every uint16 category code to an RGB triplet."""
+    palette = np.empty((np.iinfo(np.uint16).max + 1, 3), dtype=np.ubyte)
+    palette[:] = fallback
+    palette[list(category_to_rgb)] = list(category_to_rgb.values())
+    return palette
+
+
+CATEGORY_PALETTE = build_palette()
+KNOWN_CATEGORIES = np.zeros(len(CATEGORY_PALETTE), dtype=bool)
+KNOWN_CATEGORIES[list(CATEGORY_TO_RGB)] = True
+
+
+# Index of every uint16 category code in a PNG palette, unknown ones use the last entry
+CATEGORY_INDEX = np.full(len(CATEGORY_PALETTE), len(CATEGORY_TO_RGB), dtype=np.ubyte)
+CATEGORY_INDEX[list(CATEGORY_TO_RGB)] = np.arange(len(CATEGORY_TO_RGB))
+PNG_COLORMAP = dict(enumerate([*CATEGORY_TO_RGB.values(), UNKNOWN_CATEGORY_RGB]))
+
+
+def _warn_unknown_categories(array):
+    counts = np.bincount(array.ravel(), minlength=len(CATEGORY_PALETTE))
+    for category in np.flatnonzero((counts > 0) & ~KNOWN_CATEGORIES):
+        warnings.warn(f"Category {category} not found")
+
+
+def colorize(array, out_dtype=np.ubyte):
+    """Convert a uint16 category raster into an RGB image in a single pass."""
+    array = np.asarray(array, dtype=np.uint16)
+    _warn_unknown_categories(array)
+    image = np.take(CATEGORY_PALETTE, array, axis=0)
+    return image if image.dtype == out_dtype else image.astype(out_dtype)
+
+
+def segmentation_to_image(
+    segmentation,
+    cloud_mask,
+    out_dtype=np.ubyte,
+    max_shape=None,
+    mask_clouds=False,
+):
+    array = read_inmemory(segmentation, dtype=rasterio.uint16, max_shape=max_shape).squeeze()
+    image = colorize(array, out_dtype=out_dtype)
+    if mask_clouds and cloud_mask:
+        cloud_array = read_inmemory(
+            cloud_mask,
+            height=array.shape[0],
+            width=array.shape[1],
+            resampling=Resampling.nearest,
+            dtype=rasterio.ubyte,
+        ).squeeze()
+        image[cloud_array > 0] = (255, 255, 255)  # Remove cloud areas
+    return image
 
-def read_inmemory(segmentation, width=None, height=None, resampling=None, dtype=None):
 
-    with MemoryFile(segmentation) as memfile:
+def encode_png(indices, colormap=PNG_COLORMAP) -> bytes:
+    """Encode a raster of palette indices as a paletted PNG with the highest compression."""
+    height, width = indices.shape
+    with warnings.catch_warnings(), MemoryFile() as memfile:
+        # A PNG image for the map has no georeferencing
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
         with memfile.open(
-            mode="r",
-            count=1,
+            driver="PNG",
             width=width,
             height=height,
-            resampling=resampling,
-            dtype=dtype,
+            count=1,
+            dtype=rasterio.ubyte,
+            zlevel=9,
         ) as dataset:
-            return dataset.read()
-
-
-def segmentation_to_image(segmentation, cloud_mask, out_dtype=np.ubyte):
-    array = read_inmemory(segmentation, dtype=rasterio.uint16).squeeze()
-    # cloud_array = read_inmemory(
-    #     cloud_mask,
-    #     height=array.shape[0],
-    #     width=array.shape[1],
-    #     resampling=Resampling.nearest,
-    #     dtype=rasterio.ubyte,
-    # ).squeeze()
-    categories = np.unique(array)
-    image = np.empty((array.shape[0], array.shape[1], 3), dtype=out_dtype)
-
-    for category in categories:
-        mask = array == category
+            dataset.write(indices, 1)
+            dataset.write_colormap(1, colormap)
+        return memfile.read()
+
+
+def png_url(png: bytes) -> str:
+    return f"data:image/png;base64,{base64.b64encode(png).decode()}"
+
+
+def segmentation_to_png(segmentation, cloud_mask, max_shape=None) -> str:
+    """Data URL of a segmentation encoded as a paletted PNG, to be given to an `ImageOverlay`.
+
+    The PNG stores a byte per pixel instead of three for an RGB image.
+    """
+    array = read_inmemory(segmentation, dtype=rasterio.uint16, max_shape=max_shape, pool=BUFFERS)
+    try:
+        _warn_unknown_categories(array[0])
+        indices = BUFFERS.acquire(array.shape[1:], np.ubyte)
         try:
-            image[mask] = CATEGORY_TO_RGB[category]
-        except KeyError:
-            warnings.warn(f"Category {category} not found")
-            image[mask] = (255, 255, 255)
-    # image[cloud_array] = (255, 255, 255)  # Remove cloud areas
-    return image
+            return png_url(encode_png(np.take(CATEGORY_INDEX, array[0], out=indices)))
+        finally:
+            BUFFERS.release(indices)
+    finally:
+        BUFFERS.release(array)
+
+
+POPUP_FIELDS = (
+    "creation_date",
+    "publication_date",
+    "product_id",
+    "quicklook_url",
+    "cloud_cover",
+    "browse_url",
+    "download_url",
+)
+# Layout of `DataFrame.to_html`, the values are filled by position
+POPUP_TEMPLATE = (
+    '<table border="1" class="dataframe '
+    'table table-striped table-hover table-condensed table-responsive">'
+    '<thead><tr style="text-align: right;"><th></th><th>names</th><th>values</th></tr></thead>'
+    "<tbody>"
+    + "".join(
+        f"<tr><th>{index}</th><td>{name}</td><td>{{{index}}}</td></tr>"
+        for index, name in enumerate(POPUP_FIELDS)
+    )
+    + "</tbody></table>"
+)
+
+
+def popup_columns(responses) -> List[List[str]]:
+    """Escaped values of the popup fields of the responses, one list per field."""
+    return [
+        [html.escape(str(value)) for value in column]
+        for column in (
+            [response.creation_date.ToDatetime() for response in responses],
+            [response.publication_date.ToDatetime() for response in responses],
+            [response.product_id for response in responses],
+            [response.quicklook for response in responses],
+            [round(response.cloud_cover, 6) for response in responses],
+            [response.browse_url for response in responses],
+            [response.download_url for response in responses],
+        )
+    ]
+
+
+def popups_html(responses) -> List[str]:
+    """Popup of each response, rendered from the columns of their metadata in one pass."""
+    return [POPUP_TEMPLATE.format(*row) for row in zip(*popup_columns(responses))]
+
+
+def popup_html(response) -> str:
+    return popups_html([response])[0]
+
+
+class MapLayers(NamedTuple):
+    """Layers shared by the responses drawn on a map."""
+
+    footprints: folium.GeoJson
+    markers: MarkerCluster
+
+
+def add_responses_to_map(map_, responses, images=None, layers=None, overlay=True):
+    """Draw responses on the map, parsing their footprints at once.
+
+    The footprints are added with their properties to a single GeoJSON layer and the
+    markers to a single cluster, these `layers` are created when None and returned to
+    be extended by the next calls. The segmentations are decoded unless `images` gives
+    an RGB array or the URL of the image of each response. Without `overlay`, only the
+    footprints and the markers are drawn.
+    """
+    geoms = shapely.from_wkt([response.wkt for response in responses])
+    bounds = shapely.bounds(geoms)
+    centroids = shapely.get_coordinates(shapely.centroid(geoms))
+    if layers is None:
+        layers = MapLayers(
+            footprints=folium.GeoJson(
+                {"type": "FeatureCollection", "features": []},
+                name="Footprints",
+            ).add_to(map_),
+            markers=MarkerCluster(name="Products").add_to(map_),
+        )
+    layers.footprints.data["features"].extend(
+        {
+            "type": "Feature",
+            "geometry": json.loads(geometry),
+            "properties": {
+                "product_id": response.product_id,
+                "product_type": response.product_type,
+                "publication_date": response.publication_date.ToJsonString(),
+                "cloud_cover": response.cloud_cover,
+            },
+        }
+        for response, geometry in zip(responses, shapely.to_geojson(geoms))
+    )
+    popups = popups_html(responses)
+    for index, response in enumerate(responses):
+        xmin, ymin, xmax, ymax = bounds[index]
+        if overlay:
+            image = images[index] if images is not None else None
+            if image is None:
+                image = segmentation_to_image(response.segmentation, response.cloud_mask)
+            folium.raster_layers.ImageOverlay(
+                image,
+                bounds=((ymin, xmin), (ymax, xmax)),
+                name=response.product_id,
+                overlay=True,
+                control=False,
+                opacity=0.8,
+            ).add_to(map_)
+        folium.Marker(
+            location=centroids[index][::-1].tolist(),
+            tooltip=f"{response.product_id}",
+            popup=folium.Popup(popups[index]),
+        ).add_to(layers.markers)
+    return layers
+
+
+async def _receive_stage(responses: AsyncIterator, outbox: asyncio.Queue):
+    try:
+        async for response in responses:
+            # Blocks while the decode stage is behind, which stops reading the stream
+            await outbox.put(response)
+    except Exception as exc:
+        # Errors are passed down the pipeline and raised by the last stage
+        await outbox.put(exc)
+    await outbox.put(None)
+
+
+async def _decode_stage(executor, inbox: asyncio.Queue, outbox: asyncio.Queue, decode):
+    """Run the `(function, *args)` returned by `decode` for each response in `executor`."""
+    loop = asyncio.get_running_loop()
+    while True:
+        response = await inbox.get()
+        if response is None:
+            break
+        if isinstance(response, Exception):
+            await outbox.put(response)
+            continue
+        task = decode(response)
+        # Nothing to decode, e.g. the segmentation is rendered by the tile server
+        result = loop.run_in_executor(executor, *task) if task is not None else None
+        # The size of the outbox bounds the number of rasters decoded at once
+        await outbox.put((response, result))
+    await outbox.put(None)
 
 
 def plot_responses(
@@ -179,11 +610,71 @@ def plot_responses(
     product_ids,
     categories,
     n_results,
+    incremental=False,
+    grid=None,
+    windows=None,
+    cache=None,
+    executor=None,
+    queue_size=4,
+    zoom=3,
+    decode_zoom=None,
+    tiles=None,
+    mosaic=None,
+    predicate=None,
+    catalog=None,
+    client=None,
 ):
+    """Query earthsignature and draw the responses on a folium map.
+
+    Receiving, decoding and rendering run as a pipeline of stages connected by queues
+    of `queue_size` responses: the responses are decoded in `executor`, the default
+    executor of the event loop when None, while the next ones are received and the
+    previous ones drawn, in the order they were received. A slow stage throttles the
+    previous ones once the queue between them is full. Rasters are encoded to paletted
+    PNGs by the executor as well.
+    The map is displayed at `zoom` and rasters are decoded at the resolution they have
+    at `decode_zoom`, `zoom` when None, raise it to keep the details when zooming in.
+    With `incremental`, the map is displayed right away and refreshed after each new
+    layer. A `(rows, cols)` `grid` splits the area of interest into tiles queried
+    concurrently, a number of `windows` splits the date range instead.
+    Responses are served from `cache` when they were already received.
+    With a `TileServer` as `tiles`, the segmentations are served as tiles rendered on
+    demand instead of being decoded and inlined in the map. With a `Mosaic`, the
+    segmentations are warped into its canvas and added to the map as a single overlay.
+    Responses rejected by `predicate` are dropped before their rasters are decoded.
+    Responses already in `catalog` are not fetched again, it excludes `grid` and `windows`.
+    Requests are sent with `client`, such as one built by `EarthSignatureClient.from_config`,
+    or the client shared by the endpoint when None.
+    """
+    if tiles is not None and mosaic is not None:
+        raise ValueError("Tiles and mosaic cannot be combined")
     product_ids = product_ids.value.split(",") if product_ids.value else None
     categories = categories.value.split(",") if categories.value else None
-    responses = asyncio.run(
-        request_earthsignature(
+    map_ = folium.Map(
+        location=MAP_CENTER["coordinates"][::-1],
+        zoom_start=zoom,
+        crs="EPSG3857",
+    )
+    layer = None
+    if tiles is not None:
+        layer = tiles.add_layer()
+        folium.TileLayer(
+            tiles=layer.url,
+            attr="SnapEarth",
+            name="Segmentation",
+            overlay=True,
+            control=False,
+            opacity=0.8,
+        ).add_to(map_)
+    handle = None
+    if incremental:
+        # Only the notebook needs IPython, the stand-in server imports this module too
+        from IPython.display import display
+
+        handle = display(map_, display_id=True)
+
+    async def draw():
+        responses = stream_earthsignature(
             host,
             port,
             use_ssl,
@@ -193,59 +684,81 @@ def plot_responses(
             product_ids,
             categories,
             n_results.value,
-        ),
-    )
-
-    map_ = folium.Map(
-        location=MAP_CENTER["coordinates"][::-1],
-        zoom_start=3,
-        crs="EPSG3857",
-    )
-    data = []
-    for response in tqdm(responses):
-        geom = wkt.loads(response.wkt)
-        folium.GeoJson(geom).add_to(map_)
-        centroid = mapping(geom.centroid)
-        bounds = geom.bounds
-        bounds = (
-            (bounds[1], bounds[0]),
-            (bounds[3], bounds[2]),
+            grid=grid,
+            windows=windows,
+            cache=cache,
+            predicate=predicate,
+            catalog=catalog,
+            client=client,
         )
-        image = segmentation_to_image(response.segmentation, response.cloud_mask)
-        folium.raster_layers.ImageOverlay(
-            image,
-            bounds=bounds,
-            name=response.product_id,
-            overlay=True,
-            control=False,
-            opacity=0.8,
-        ).add_to(map_)
-        names = [
-            "creation_date",
-            "publication_date",
-            "product_id",
-            "quicklook_url",
-            "cloud_cover",
-            "browse_url",
-            "download_url",
-        ]
-        responses = [
-            response.creation_date.ToDatetime(),
-            response.publication_date.ToDatetime(),
-            response.product_id,
-            response.quicklook,
-            response.cloud_cover,
-            response.browse_url,
-            response.download_url,
+        total = n_results.value if grid is None and windows is None else None
+
+        def decode(response):
+            if layer is not None:
+                return None
+            if mosaic is not None:
+                return mosaic.decode(response)
+            # Rasters are not decoded at a higher resolution than they are displayed
+            max_shape = display_shape(wkt.loads(response.wkt).bounds, decode_zoom or zoom)
+            return segmentation_to_png, response.segmentation, response.cloud_mask, max_shape
+
+        received = asyncio.Queue(maxsize=queue_size)
+        decoded = asyncio.Queue(maxsize=queue_size)
+        stages = [
+            asyncio.create_task(_receive_stage(responses, received)),
+            asyncio.create_task(_decode_stage(executor, received, decoded, decode)),
         ]
-        df = pd.DataFrame({"names": names, "values": responses})
-        html = df.to_html(
-            classes="table table-striped table-hover table-condensed table-responsive",
-        )
-        folium.Marker(
-            location=centroid["coordinates"][::-1],
-            tooltip=f"{response.product_id}",
-            popup=folium.Popup(html),
-        ).add_to(map_)
+        try:
+            with tqdm(total=total) as progress:
+                layers = None
+                done = False
+                while not done:
+                    # Draw every response already decoded at once
+                    items = [await decoded.get()]
+                    while not decoded.empty():
+                        items.append(decoded.get_nowait())
+                    batch = []
+                    for item in items:
+                        if item is None:
+                            done = True
+                            break
+                        if isinstance(item, Exception):
+                            raise item
+                        batch.append(item)
+                    if not batch:
+                        continue
+                    responses = [response for response, _ in batch]
+                    results = [await result if result is not None else None for _, result in batch]
+                    if layer is not None:
+                        for response in responses:
+                            layer.add(response)
+                    elif mosaic is not None:
+                        for response, result in zip(responses, results):
+                            if result is not None:
+                                mosaic.add(response, result)
+                    layers = add_responses_to_map(
+                        map_,
+                        responses,
+                        results,
+                        layers=layers,
+                        overlay=layer is None and mosaic is None,
+                    )
+                    if layer is None:
+                        # The rasters are decoded, release them while the others are drawn
+                        for response in responses:
+                            response.ClearField("segmentation")
+                            response.ClearField("cloud_mask")
+                    progress.update(len(responses))
+                    if handle is not None:
+                        handle.update(map_)
+            if mosaic is not None:
+                mosaic.add_to(map_, name="Mosaic", control=False, opacity=0.8)
+                if handle is not None:
+                    handle.update(map_)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
 
+    asyncio.run(draw())
     return map_
@@ -0,0 +1,127 @@
+"""Lightweight views of the responses and filters on their metadata.
+
+A `ResponseView` reads the metadata of a response once and only decodes its rasters when
+they are accessed. A `ResponseFilter` only looks at the metadata, so the responses it
+drops are never decoded.
+"""
+from datetime import date, datetime
+from typing import Iterable, Optional, Union
+
+import numpy as np
+import shapely
+from shapely import wkt
+from shapely.geometry.base import BaseGeometry
+
+from snapearth.api.v1.database_pb2 import SegmentationResponse
+from utils import read_inmemory
+
+
+class ResponseView:
+    """Metadata of a response, its segmentation and cloud mask are decoded on first access."""
+
+    __slots__ = (
+        "response",
+        "product_id",
+        "product_type",
+        "publication_date",
+        "creation_date",
+        "cloud_cover",
+        "wkt",
+        "_footprint",
+        "_segmentation",
+        "_cloud_mask",
+    )
+
+    def __init__(self, response: SegmentationResponse):
+        self.response = response
+        self.product_id = response.product_id
+        self.product_type = response.product_type
+        self.publication_date = response.publication_date.ToDatetime()
+        self.creation_date = response.creation_date.ToDatetime()
+        self.cloud_cover = response.cloud_cover
+        self.wkt = response.wkt
+        self._footprint = None
+        self._segmentation = None
+        self._cloud_mask = None
+
+    def __repr__(self) -> str:
+        return f"ResponseView({self.product_id!r}, {self.publication_date.isoformat()})"
+
+    @property
+    def footprint(self) -> BaseGeometry:
+        if self._footprint is None:
+            self._footprint = wkt.loads(self.wkt)
+        return self._footprint
+
+    @property
+    def segmentation(self) -> np.ndarray:
+        """Categories of the first band of the segmentation."""
+        if self._segmentation is None:
+            self._segmentation = read_inmemory(self.response.segmentation)[0]
+        return self._segmentation
+
+    @property
+    def cloud_mask(self) -> Optional[np.ndarray]:
+        """Cloud mask of the first band, None when the response has none."""
+        if self._cloud_mask is None and self.response.cloud_mask:
+            self._cloud_mask = read_inmemory(self.response.cloud_mask)[0]
+        return self._cloud_mask
+
+    def release(self):
+        """Drop the decoded rasters, they are decoded again on the next access."""
+        self._segmentation = None
+        self._cloud_mask = None
+
+
+def _datetime(value: Union[date, datetime, None], end: bool = False) -> Optional[datetime]:
+    """Datetime of a date, at the start of the day or at its end with `end`."""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.combine(value, datetime.max.time() if end else datetime.min.time())
+
+
+class ResponseFilter:
+    """Predicate on the metadata of a response or a `ResponseView`.
+
+    A response is kept when its cloud cover is at most `max_cloud_cover`, its product type
+    is one of `product_types`, it was published between `start_date` and `end_date`
+    included and its footprint intersects `intersects`. Unset criteria are ignored, the
+    footprint is only parsed when the other ones pass.
+    """
+
+    def __init__(
+        self,
+        max_cloud_cover: Optional[float] = None,
+        product_types: Optional[Iterable[str]] = None,
+        start_date: Union[date, datetime, None] = None,
+        end_date: Union[date, datetime, None] = None,
+        intersects: Optional[BaseGeometry] = None,
+    ):
+        self.max_cloud_cover = max_cloud_cover
+        self.product_types = frozenset(product_types) if product_types is not None else None
+        self.start_date = _datetime(start_date)
+        self.end_date = _datetime(end_date, end=True)
+        self.intersects = intersects
+        if intersects is not None:
+            shapely.prepare(intersects)
+
+    def __call__(self, response: Union[SegmentationResponse, ResponseView]) -> bool:
+        if self.max_cloud_cover is not None and response.cloud_cover > self.max_cloud_cover:
+            return False
+        if self.product_types is not None and response.product_type not in self.product_types:
+            return False
+        if self.start_date is not None or self.end_date is not None:
+            published = response.publication_date
+            if not isinstance(published, datetime):
+                published = published.ToDatetime()
+            if self.start_date is not None and published < self.start_date:
+                return False
+            if self.end_date is not None and published > self.end_date:
+                return False
+        if self.intersects is not None:
+            if isinstance(response, ResponseView):
+                footprint = response.footprint
+            else:
+                footprint = wkt.loads(response.wkt)
+            return self.intersects.intersects(footprint)
+        return True